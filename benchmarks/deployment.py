@@ -0,0 +1,140 @@
+"""
+end-to-end deployment benchmark. Replays the recorded CloudFormation custom resource events in events/ through
+provider.handler against the WAF simulator, with injected API and propagation latency on a virtual clock, and
+writes the results per scenario as JSON.
+
+    PYTHONPATH=src:. python benchmarks/deployment.py [--output results.json]
+"""
+import argparse
+import copy
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from contextlib import contextmanager, redirect_stdout
+
+from mock import Mock, patch
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+import polling  # noqa: E402
+import provider  # noqa: E402
+from checkpoints import LocalFileCheckpointStore  # noqa: E402
+from tests.waf_simulator import VirtualClock, WafSimulator  # noqa: E402
+
+EVENTS = os.path.join(os.path.dirname(__file__), 'events', 'rate-based-rule.json')
+
+SCENARIOS = [(rules, predicates) for rules in [1, 10, 100] for predicates in [0, 5, 20]]
+
+
+def load_events():
+    with open(EVENTS) as f:
+        return {event['RequestType']: event for event in json.load(f)}
+
+
+def predicates(start, count):
+    return [{'Negated': 'False', 'Type': 'IPMatch', 'DataId': f'ipset-{i}'} for i in range(start, start + count)]
+
+
+def rule_properties(properties, index, rate_limit, match_predicates):
+    properties = dict(properties, Name=f'rule{index}', MetricName=f'rule{index}metric', RateLimit=str(rate_limit))
+    if match_predicates:
+        properties['MatchPredicates'] = match_predicates
+    return properties
+
+
+@contextmanager
+def capture_responses(responses):
+    def put(url, json=None, headers=None):
+        responses.append(copy.deepcopy(json))
+        return Mock(status_code=200, text='')
+
+    with patch('requests.put', put):
+        yield
+
+
+def replay(events, rules, predicate_count):
+    """
+    replays the lifecycle Create -> Update -> Delete of `rules` rules with `predicate_count` predicates each. The
+    update changes the rate limit and replaces half of the predicates.
+    """
+    physical_resource_ids = []
+    for i in range(rules):
+        request = copy.deepcopy(events['Create'])
+        request['RequestId'] = f"{request['RequestId']}-{i}"
+        request['ResourceProperties'] = rule_properties(request['ResourceProperties'], i, 4500,
+                                                        predicates(0, predicate_count))
+        physical_resource_ids.append(provider.handler(request, ())['PhysicalResourceId'])
+
+    for i, physical_resource_id in enumerate(physical_resource_ids):
+        request = copy.deepcopy(events['Update'])
+        request['RequestId'] = f"{request['RequestId']}-{i}"
+        request['PhysicalResourceId'] = physical_resource_id
+        request['OldResourceProperties'] = rule_properties(request['OldResourceProperties'], i, 4500,
+                                                           predicates(0, predicate_count))
+        request['ResourceProperties'] = rule_properties(request['ResourceProperties'], i, 5000,
+                                                        predicates(predicate_count // 2, predicate_count))
+        provider.handler(request, ())
+
+    for i, physical_resource_id in enumerate(physical_resource_ids):
+        request = copy.deepcopy(events['Delete'])
+        request['RequestId'] = f"{request['RequestId']}-{i}"
+        request['PhysicalResourceId'] = physical_resource_id
+        provider.handler(request, ())
+
+
+def run_scenario(events, rules, predicate_count, call_latency, propagation_delay):
+    polling.propagation_history.clear()
+    for scope in provider.rate_based_rule_provider.scopes.values():
+        scope.rule_index.invalidate()
+    clock = VirtualClock()
+    simulator = WafSimulator(propagation_delay=propagation_delay, call_latency=call_latency, clock=clock)
+    responses = []
+
+    started, real_started = clock.time(), time.perf_counter()
+    with simulator.patch(), capture_responses(responses), open(os.devnull, 'w') as devnull, redirect_stdout(devnull), \
+            tempfile.TemporaryDirectory() as directory, \
+            patch('rate_based_rule_provider.checkpoints', LocalFileCheckpointStore(directory)):
+        replay(events, rules, predicate_count)
+
+    return {
+        'rules': rules,
+        'predicates': predicate_count,
+        'wall_clock_seconds': round(clock.time() - started, 3),
+        'sleep_seconds': round(clock.slept, 3),
+        'api_calls': sum(simulator.api_calls.values()),
+        'api_calls_by_operation': dict(simulator.api_calls),
+        'change_tokens_consumed': simulator.change_tokens_consumed,
+        'failed_responses': len([r for r in responses if r['Status'] != 'SUCCESS']),
+        'benchmark_seconds': round(time.perf_counter() - real_started, 3)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark Create, Update and Delete of rate-based rules')
+    parser.add_argument('--output', help='file to write the JSON results to, default stdout')
+    parser.add_argument('--call-latency', type=float, default=0.1, help='seconds per WAF API call')
+    parser.add_argument('--propagation-delay', type=float, default=20.0, help='seconds until a change is INSYNC')
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    events = load_events()
+    results = {
+        'call_latency': args.call_latency,
+        'propagation_delay': args.propagation_delay,
+        'scenarios': [run_scenario(events, rules, predicate_count, args.call_latency, args.propagation_delay)
+                      for rules, predicate_count in SCENARIOS]
+    }
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        sys.stdout.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
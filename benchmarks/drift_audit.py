@@ -0,0 +1,86 @@
+"""
+drift audit benchmark. Audits an account of rate-based rules in the WAF simulator, with injected API latency and a
+rate limiter, for an increasing number of rules and worker threads, and writes the results per scenario as JSON.
+
+    PYTHONPATH=src:. python benchmarks/drift_audit.py [--output results.json]
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+import boto3  # noqa: E402
+
+from audit import audit  # noqa: E402
+from metrics import InstrumentedClient  # noqa: E402
+from tests.waf_simulator import WafSimulator  # noqa: E402
+from throttling import RetryingClient, TokenBucket  # noqa: E402
+
+SCENARIOS = [(rules, workers) for rules in [100, 500] for workers in [1, 8, 16]]
+
+
+def populate(simulator, rules):
+    """
+    creates the `rules` in the simulator, and returns their declared state with every tenth rule drifted.
+    """
+    declared = []
+    for i in range(rules):
+        rule_id = f'rule-id-{i}'
+        predicates = [{'Negated': False, 'Type': 'IPMatch', 'DataId': f'ipset-{i}'}]
+        simulator.rules[rule_id] = {'RuleId': rule_id, 'Name': f'rule{i}', 'MetricName': f'rule{i}metric',
+                                    'MatchPredicates': predicates, 'RateKey': 'IP', 'RateLimit': 2000}
+        declared.append({'Name': f'rule{i}', 'MetricName': f'rule{i}metric', 'RateKey': 'IP',
+                         'RateLimit': '3000' if i % 10 == 0 else '2000',
+                         'MatchPredicates': [{'Negated': 'False', 'Type': 'IPMatch', 'DataId': f'ipset-{i}'}]})
+    return {'Rules': declared}
+
+
+def run_scenario(rules, workers, call_latency, calls_per_second):
+    simulator = WafSimulator(call_latency=call_latency, max_calls_per_second=calls_per_second * 2)
+    document = populate(simulator, rules)
+    with simulator.patch():
+        client = RetryingClient(InstrumentedClient(boto3.client('waf')), bucket=TokenBucket(calls_per_second))
+        started = time.perf_counter()
+        statuses = [report['Status'] for report in audit(client, document, max_workers=workers)]
+        seconds = time.perf_counter() - started
+
+    return {
+        'rules': rules,
+        'workers': workers,
+        'seconds': round(seconds, 3),
+        'drifted': statuses.count('DRIFTED'),
+        'in_sync': statuses.count('IN_SYNC'),
+        'api_calls': sum(simulator.api_calls.values()),
+        'throttled': simulator.throttled,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark the drift audit of rate-based rules')
+    parser.add_argument('--output', help='file to write the JSON results to, default stdout')
+    parser.add_argument('--call-latency', type=float, default=0.05, help='seconds per WAF API call')
+    parser.add_argument('--calls-per-second', type=float, default=100.0, help='rate limit of the WAF client')
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    results = {
+        'call_latency': args.call_latency,
+        'calls_per_second': args.calls_per_second,
+        'scenarios': [run_scenario(rules, workers, args.call_latency, args.calls_per_second)
+                      for rules, workers in SCENARIOS]
+    }
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        sys.stdout.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
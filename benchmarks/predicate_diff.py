@@ -0,0 +1,28 @@
+"""
+micro-benchmark of the predicate diff of an update request.
+
+    PYTHONPATH=src python benchmarks/predicate_diff.py
+"""
+import json
+import timeit
+
+from predicates import diff_predicates
+
+
+def predicates(start, stop):
+    return [{'Negated': i % 2 == 0, 'Type': 'IPMatch', 'DataId': f'data-id-{i}'} for i in range(start, stop)]
+
+
+def main():
+    results = []
+    for size in [100, 1000, 2000, 5000]:
+        old = predicates(0, size)
+        new = predicates(size // 4, size + size // 4)   # a quarter deleted, a quarter inserted
+        number = 20
+        seconds = timeit.timeit(lambda: diff_predicates(old, new), number=number) / number
+        results.append({'predicates': size, 'seconds': round(seconds, 6)})
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+cold start benchmark. Measures the time to import the provider and to handle a first request in a fresh
+interpreter, and the size of the Lambda package if one is given. Writes the results as JSON.
+
+    PYTHONPATH=src:. python benchmarks/startup.py [--package target/cfn-waf-provider-<version>.zip] [--output results.json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import zipfile
+from collections import defaultdict
+
+# runs in a fresh interpreter, so that nothing is imported yet
+PROBE = """
+import json, os, time
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+started = time.perf_counter()
+import provider
+imported = time.perf_counter()
+from tests.waf_simulator import WafSimulator
+with WafSimulator().patch():
+    provider.rate_based_rule_provider.scopes.get('Global').client.get_change_token()
+print(json.dumps({'import_seconds': imported - started, 'first_call_seconds': time.perf_counter() - imported}))
+"""
+
+
+def measure_startup(runs):
+    samples = []
+    for _ in range(runs):
+        output = subprocess.check_output([sys.executable, '-c', PROBE], env=os.environ)
+        samples.append(json.loads(output.decode('utf-8').strip().splitlines()[-1]))
+    return {name: round(statistics.median(s[name] for s in samples), 4)
+            for name in ['import_seconds', 'first_call_seconds']}
+
+
+def measure_package(path):
+    sizes = defaultdict(int)
+    with zipfile.ZipFile(path) as package:
+        entries = package.infolist()
+        for entry in entries:
+            sizes[entry.filename.split('/')[0]] += entry.file_size
+    largest = sorted(sizes.items(), key=lambda item: item[1], reverse=True)[:10]
+    return {
+        'package_bytes': os.path.getsize(path),
+        'uncompressed_bytes': sum(entry.file_size for entry in entries),
+        'files': len(entries),
+        'largest_entries': [{'name': name, 'bytes': size} for name, size in largest]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark the cold start of the provider')
+    parser.add_argument('--package', help='the Lambda zip file to report the size of')
+    parser.add_argument('--runs', type=int, default=5, help='number of fresh interpreters to measure')
+    parser.add_argument('--output', help='file to write the JSON results to, default stdout')
+    args = parser.parse_args()
+
+    results = {'runs': args.runs}
+    results.update(measure_startup(args.runs))
+    if args.package:
+        results.update(measure_package(args.package))
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        sys.stdout.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
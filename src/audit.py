@@ -0,0 +1,126 @@
+"""
+audits the rate-based rules of an account for drift against a declared-state document, which has the properties of
+a Custom::RateBasedRuleSet: the Rules, and optionally the Scope and Region.
+
+    PYTHONPATH=src python src/audit.py declared-state.json [--workers 8]
+
+writes a drift report per rule as a JSON line, as soon as the rule has been read.
+"""
+import argparse
+import copy
+import json
+import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from botocore.exceptions import ClientError
+
+import logs
+from predicates import diff_predicates
+from rate_based_rule_provider import is_nonexistent_item, scopes
+from rule_index import RuleIndex
+from rules import RULE_SCHEMA, compile_schema
+
+log = logging.getLogger(__name__)
+
+# the maximum number of rules read concurrently, on top of the shared rate limiter of the WAF clients
+AUDIT_WORKERS = int(os.environ.get('AUDIT_WORKERS', '8'))
+
+
+def declared_rules(document):
+    """
+    returns the rules of the declared-state `document` by name, with their properties coerced like those of a request.
+    """
+    schema = compile_schema(RULE_SCHEMA)
+    return {rule['Name']: schema.coerce(copy.deepcopy(rule)) for rule in document.get('Rules', [])}
+
+
+def compare(rule, declared):
+    """
+    returns the drift report of the live `rule` against its `declared` properties, if any.
+    """
+    report = {'Name': rule['Name'], 'RuleId': rule['RuleId']}
+    if declared is None:
+        report['Status'] = 'UNDECLARED'
+        return report
+
+    differences = {name: {'Declared': declared.get(name), 'Live': rule.get(name)}
+                   for name in ['MetricName', 'RateKey', 'RateLimit'] if declared.get(name) != rule.get(name)}
+    deletes, inserts = diff_predicates(rule.get('MatchPredicates', []), declared.get('MatchPredicates', []))
+    report['Status'] = 'DRIFTED' if differences or deletes or inserts else 'IN_SYNC'
+    if differences:
+        report['Differences'] = differences
+    if deletes:
+        report['UndeclaredPredicates'] = deletes
+    if inserts:
+        report['MissingPredicates'] = inserts
+    return report
+
+
+def audit(client, document, max_workers=AUDIT_WORKERS):
+    """
+    pages through the rate-based rules of the account, reads them on a pool of `max_workers` threads, and yields the
+    drift report of every rule against the declared-state `document` as soon as it has been read. Declared rules which
+    do not exist are reported last.
+    """
+    declared = declared_rules(document)
+    rule_ids = RuleIndex(client).load()
+    seen = set()
+
+    def get_rule(rule_id):
+        try:
+            return client.get_rate_based_rule(RuleId=rule_id)['Rule']
+        except ClientError as error:
+            if is_nonexistent_item(error):
+                return None     # deleted since it was listed
+            raise
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(get_rule, rule_id) for ids in rule_ids.values() for rule_id in ids]
+        for future in as_completed(futures):
+            rule = future.result()
+            if rule is not None:
+                seen.add(rule['Name'])
+                yield compare(rule, declared.get(rule['Name']))
+
+    for name in sorted(set(declared) - seen):
+        yield {'Name': name, 'Status': 'MISSING'}
+
+
+def handler(request, context):
+    """
+    audits the rules against the declared-state document in the WafAudit field of the `request`. Every drift report is
+    logged as it is made, and the reports are returned with the number of rules per status.
+    """
+    document = request['WafAudit']
+    logs.correlation.id = request.get('RequestId')
+    client = scopes.get(document.get('Scope', 'Global'), document.get('Region')).client
+    reports, summary = [], {}
+    for report in audit(client, document):
+        log.info('Rule %s is %s.', report['Name'], report['Status'], extra={'report': report})
+        summary[report['Status']] = summary.get(report['Status'], 0) + 1
+        reports.append(report)
+    return {'Summary': summary, 'Reports': reports}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='audit the rate-based rules for drift against a declared state')
+    parser.add_argument('document', help='the declared-state JSON document')
+    parser.add_argument('--workers', type=int, default=AUDIT_WORKERS, help='number of rules read concurrently')
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    with open(args.document) as f:
+        document = json.load(f)
+    client = scopes.get(document.get('Scope', 'Global'), document.get('Region')).client
+    drifted = False
+    for report in audit(client, document, args.workers):
+        sys.stdout.write(json.dumps(report) + '\n')
+        sys.stdout.flush()
+        drifted = drifted or report['Status'] in ('DRIFTED', 'MISSING')
+    sys.exit(1 if drifted else 0)
+
+
+if __name__ == '__main__':
+    main()
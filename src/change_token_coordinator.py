@@ -0,0 +1,146 @@
+import fcntl
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import boto3
+from botocore.exceptions import ClientError
+
+from clients import LazyClient
+from metrics import metrics
+
+log = logging.getLogger(__name__)
+
+
+class LeaseTimeout(Exception):
+    pass
+
+
+class LocalLockBackend(object):
+    """
+    serializes mutations within this process, and across processes on this host when a lock file `path` is given.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def lease(self):
+        with self.lock:
+            if self.path is None:
+                yield
+                return
+
+            with open(self.path, 'a') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class DynamoDBLockBackend(object):
+    """
+    serializes mutations across Lambda invocations using a conditional write on a DynamoDB table with the
+    partition key `LockId`. A lease expires after `lease_seconds`, so a crashed holder does not block others forever.
+    """
+
+    def __init__(self, table_name, lock_id='waf-change-token', lease_seconds=30, timeout=120, dynamodb=None):
+        self.table_name = table_name
+        self.lock_id = lock_id
+        self.lease_seconds = lease_seconds
+        self.timeout = timeout
+        self.dynamodb = dynamodb if dynamodb is not None else LazyClient(lambda: boto3.client('dynamodb'))
+
+    def acquire(self, owner):
+        deadline = time.time() + self.timeout
+        while True:
+            now = time.time()
+            try:
+                self.dynamodb.put_item(
+                    TableName=self.table_name,
+                    Item={'LockId': {'S': self.lock_id},
+                          'Owner': {'S': owner},
+                          'Expires': {'N': str(int(now + self.lease_seconds))}},
+                    ConditionExpression='attribute_not_exists(LockId) OR Expires < :now',
+                    ExpressionAttributeValues={':now': {'N': str(int(now))}})
+                return
+            except ClientError as error:
+                if error.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+            if now >= deadline:
+                raise LeaseTimeout(f'could not acquire lease {self.lock_id} within {self.timeout} seconds')
+            time.sleep(0.2 + random.random() * 0.3)
+
+    def release(self, owner):
+        try:
+            self.dynamodb.delete_item(
+                TableName=self.table_name,
+                Key={'LockId': {'S': self.lock_id}},
+                ConditionExpression='Owner = :owner',
+                ExpressionAttributeValues={':owner': {'S': owner}})
+        except ClientError as error:
+            # the lease expired and was taken over by someone else
+            if error.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+
+    @contextmanager
+    def lease(self):
+        owner = str(uuid.uuid4())
+        self.acquire(owner)
+        try:
+            yield
+        finally:
+            self.release(owner)
+
+
+def default_backend(lock_id='waf-change-token'):
+    """
+    returns the DynamoDB backend for the lock `lock_id` if CHANGE_TOKEN_LOCK_TABLE is set, otherwise a local lock.
+    """
+    table_name = os.environ.get('CHANGE_TOKEN_LOCK_TABLE')
+    if table_name:
+        return DynamoDBLockBackend(table_name, lock_id=lock_id)
+    return LocalLockBackend()
+
+
+def is_stale_data_error(error):
+    return error.response.get('Error', {}).get('Code') == 'WAFStaleDataException'
+
+
+class ChangeTokenCoordinator(object):
+    """
+    serializes the short get change token -> mutate window of WAF changes. The wait for the change to become INSYNC
+    happens outside of the lease. Mutations failing with a stale change token are retried with a new token.
+    """
+
+    def __init__(self, client, backend=None, max_attempts=5):
+        self.client = client
+        self.backend = backend if backend is not None else default_backend()
+        self.max_attempts = max_attempts
+
+    def mutate(self, operation):
+        """
+        calls `operation` with a fresh change token while holding the lease, and returns its response.
+        """
+        attempt, change_token = 1, None
+        while True:
+            try:
+                with self.backend.lease():
+                    change_token = self.client.get_change_token()['ChangeToken']
+                    return operation(change_token)
+            except ClientError as error:
+                if not is_stale_data_error(error) or attempt >= self.max_attempts:
+                    raise
+                log.info('Change token %s is stale, retrying with a new one (%d/%d).', change_token, attempt,
+                         self.max_attempts)
+                delay = random.random() * 0.5 * attempt
+                time.sleep(delay)
+                metrics.record_retry()
+                metrics.record_sleep(delay)
+                attempt += 1
@@ -0,0 +1,86 @@
+import hashlib
+import json
+import os
+import time
+
+import boto3
+from botocore.exceptions import ClientError
+
+from clients import LazyClient
+
+
+class LocalFileCheckpointStore(object):
+    """
+    stores checkpoints as JSON files in `directory`. In Lambda, /tmp survives between invocations of the same
+    container only, so this is meant for tests and local runs.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, key):
+        return os.path.join(self.directory, hashlib.sha256(key.encode('utf-8')).hexdigest() + '.json')
+
+    def load(self, key):
+        try:
+            with open(self.path(key)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def save(self, key, checkpoint, expires=True):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(key)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(checkpoint, f)
+        os.replace(path + '.tmp', path)
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+
+class DynamoDBCheckpointStore(object):
+    """
+    stores checkpoints in the change token lock table, under the key `checkpoint/<key>`. The checkpoints expire after
+    `ttl` seconds, unless they are saved with `expires` False.
+    """
+
+    def __init__(self, table_name, ttl=86400, dynamodb=None):
+        self.table_name = table_name
+        self.ttl = ttl
+        self.dynamodb = dynamodb if dynamodb is not None else LazyClient(lambda: boto3.client('dynamodb'))
+
+    def item_key(self, key):
+        return {'LockId': {'S': f'checkpoint/{key}'}}
+
+    def load(self, key):
+        response = self.dynamodb.get_item(TableName=self.table_name, Key=self.item_key(key), ConsistentRead=True)
+        if 'Item' not in response:
+            return None
+        return json.loads(response['Item']['Checkpoint']['S'])
+
+    def save(self, key, checkpoint, expires=True):
+        item = dict(self.item_key(key), Checkpoint={'S': json.dumps(checkpoint)})
+        if expires:
+            item['Expires'] = {'N': str(int(time.time() + self.ttl))}
+        self.dynamodb.put_item(TableName=self.table_name, Item=item)
+
+    def delete(self, key):
+        try:
+            self.dynamodb.delete_item(TableName=self.table_name, Key=self.item_key(key))
+        except ClientError as error:
+            if error.response['Error']['Code'] != 'ResourceNotFoundException':
+                raise
+
+
+def default_store():
+    """
+    returns the DynamoDB store if CHANGE_TOKEN_LOCK_TABLE is set, otherwise a local file store in CHECKPOINT_DIRECTORY.
+    """
+    table_name = os.environ.get('CHANGE_TOKEN_LOCK_TABLE')
+    if table_name:
+        return DynamoDBCheckpointStore(table_name)
+    return LocalFileCheckpointStore(os.environ.get('CHECKPOINT_DIRECTORY', '/tmp/cfn-waf-provider/checkpoints'))
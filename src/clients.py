@@ -0,0 +1,45 @@
+import threading
+
+
+class LazyClient(object):
+    """
+    a boto3 client which is created on first use by `factory`, and cached for the lifetime of the container. This
+    keeps the construction of clients, which loads the botocore service model, out of the cold start of invocations
+    which never use them.
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.client = None
+        self.lock = threading.Lock()
+
+    def get(self):
+        if self.client is None:
+            with self.lock:
+                if self.client is None:
+                    self.client = self.factory()
+        return self.client
+
+    def __getattr__(self, name):
+        if name in ('factory', 'client', 'lock'):
+            raise AttributeError(name)
+        return getattr(self.get(), name)
+
+
+class ClientPool(object):
+    """
+    boto3 clients by service and region. Each client is created lazily by `factory(service, region)` and shared by
+    all invocations handled by the container, so that warm invocations reuse its connections.
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.clients = {}
+        self.lock = threading.Lock()
+
+    def get(self, service, region=None):
+        with self.lock:
+            key = (service, region)
+            if key not in self.clients:
+                self.clients[key] = LazyClient(lambda: self.factory(service, region))
+            return self.clients[key]
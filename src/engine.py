@@ -0,0 +1,63 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+# runs the blocking boto3 calls of the coroutines, shared by all invocations handled by this container
+executor = ThreadPoolExecutor(max_workers=int(os.environ.get('ENGINE_WORKERS', '8')))
+
+
+async def call(function, *args, **kwargs):
+    """
+    runs the blocking `function` on the engine executor.
+    """
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(executor, functools.partial(function, *args, **kwargs))
+
+
+class AsyncClient(object):
+    """
+    an asyncio adapter of a boto3 client: every method returns a coroutine which makes the call on the engine
+    executor, so that independent calls overlap.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def __getattr__(self, name):
+        method = getattr(self.client, name)
+
+        async def call_method(*args, **kwargs):
+            return await call(method, *args, **kwargs)
+
+        return call_method
+
+
+def run(coroutine):
+    """
+    runs the `coroutine` to completion on a new event loop and returns its result; the synchronous facade through
+    which the provider uses the engine.
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+async def get_rules(async_client, rule_ids):
+    """
+    reads the live rules `rule_ids` concurrently. Returns the rules by id, without the rules that do not exist.
+    """
+    async def get_rule(rule_id):
+        try:
+            return (await async_client.get_rate_based_rule(RuleId=rule_id))['Rule']
+        except ClientError as error:
+            if error.response.get('Error', {}).get('Code') == 'WAFNonexistentItemException':
+                return None
+            raise
+
+    rules = await asyncio.gather(*[get_rule(rule_id) for rule_id in rule_ids])
+    return {rule['RuleId']: rule for rule in rules if rule is not None}
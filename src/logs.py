@@ -0,0 +1,44 @@
+import json
+import logging
+
+# the attributes of every LogRecord, anything else was passed in `extra` and is logged as a field
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    formats a log record as a single line JSON object with the level, the message, the correlation id of the
+    invocation and the fields passed in `extra`. The message and the fields are only formatted when the record is
+    emitted, so records below the log level cost nothing to build.
+    """
+
+    def format(self, record):
+        entry = {'level': record.levelname, 'message': record.getMessage(), 'correlation_id': correlation.id}
+        entry.update({name: value for name, value in vars(record).items() if name not in RECORD_ATTRIBUTES})
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class Correlation(object):
+    """
+    the correlation id of the invocation handled by this container, shared by all its threads.
+    """
+
+    def __init__(self):
+        self.id = None
+
+
+correlation = Correlation()
+
+
+def configure(log, level):
+    """
+    sets the `level` of `log`, and formats its records as JSON. In Lambda the root logger already has a handler
+    writing to CloudWatch, which is kept.
+    """
+    log.setLevel(level)
+    if not log.handlers:
+        log.addHandler(logging.StreamHandler())
+    for handler in log.handlers:
+        handler.setFormatter(JsonFormatter())
@@ -0,0 +1,125 @@
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+from botocore.exceptions import ClientError
+
+NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'CfnWafProvider')
+
+
+class Metrics(object):
+    """
+    collects the WAF API calls, retries, sleeps and propagation time of a single invocation, and emits them as one
+    CloudWatch Embedded Metric Format record on stdout.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started = time.time()
+            self.calls = defaultdict(int)
+            self.call_seconds = defaultdict(float)
+            self.errors = defaultdict(int)
+            self.retries = 0
+            self.sleep_seconds = 0.0
+            self.time_to_in_sync = None
+            self.propagation_failures = None
+
+    def record_call(self, operation, seconds, error_code=None):
+        with self.lock:
+            self.calls[operation] += 1
+            self.call_seconds[operation] += seconds
+            if error_code:
+                self.errors[error_code] += 1
+
+    def record_retry(self):
+        with self.lock:
+            self.retries += 1
+
+    def record_sleep(self, seconds):
+        with self.lock:
+            self.sleep_seconds += seconds
+
+    def record_time_to_in_sync(self, seconds):
+        with self.lock:
+            self.time_to_in_sync = seconds
+
+    def record_propagation(self, failed):
+        with self.lock:
+            self.propagation_failures = (self.propagation_failures or 0) + (1 if failed else 0)
+
+    def record(self, operation, **properties):
+        """
+        returns the EMF record of this invocation for the CloudFormation `operation`.
+        """
+        with self.lock:
+            values = {
+                'Duration': (time.time() - self.started, 'Seconds'),
+                'ApiCalls': (sum(self.calls.values()), 'Count'),
+                'ApiErrors': (sum(self.errors.values()), 'Count'),
+                'Throttles': (self.errors.get('ThrottlingException', 0), 'Count'),
+                'Retries': (self.retries, 'Count'),
+                'StatusPolls': (self.calls.get('get_change_token_status', 0), 'Count'),
+                'SleepTime': (self.sleep_seconds, 'Seconds'),
+            }
+            if self.time_to_in_sync is not None:
+                values['TimeToInSync'] = (self.time_to_in_sync, 'Seconds')
+            if self.propagation_failures is not None:
+                values['PropagationFailures'] = (self.propagation_failures, 'Count')
+
+            record = {
+                '_aws': {
+                    'Timestamp': int(time.time() * 1000),
+                    'CloudWatchMetrics': [{
+                        'Namespace': NAMESPACE,
+                        'Dimensions': [['Operation']],
+                        'Metrics': [{'Name': name, 'Unit': unit} for name, (_, unit) in values.items()]
+                    }]
+                },
+                'Operation': operation,
+                'ApiCallsByOperation': dict(self.calls),
+                'ApiSecondsByOperation': {name: round(s, 3) for name, s in self.call_seconds.items()},
+                'ApiErrorsByCode': dict(self.errors),
+            }
+            record.update({name: round(value, 3) for name, (value, _) in values.items()})
+            record.update(properties)
+            return record
+
+    def emit(self, operation, **properties):
+        print(json.dumps(self.record(operation, **properties)))
+
+
+# the metrics of the invocation handled by this container
+metrics = Metrics()
+
+
+class InstrumentedClient(object):
+    """
+    wraps a boto3 client, and records the number, duration and errors of its calls in `metrics`.
+    """
+
+    def __init__(self, client, metrics=metrics):
+        self.client = client
+        self.metrics = metrics
+
+    def __getattr__(self, name):
+        attribute = getattr(self.client, name)
+        if not callable(attribute) or name.startswith('_') or name in ('can_paginate', 'get_paginator'):
+            return attribute
+
+        def call(*args, **kwargs):
+            started = time.time()
+            try:
+                response = attribute(*args, **kwargs)
+                self.metrics.record_call(name, time.time() - started)
+                return response
+            except ClientError as error:
+                self.metrics.record_call(name, time.time() - started, error.response.get('Error', {}).get('Code'))
+                raise
+
+        return call
@@ -0,0 +1,65 @@
+import random
+import statistics
+import threading
+from collections import deque
+
+
+class PropagationHistory(object):
+    """
+    the most recently observed times it took for a change token to become INSYNC, in seconds.
+    """
+
+    def __init__(self, size=25):
+        self.lock = threading.Lock()
+        self.observations = deque(maxlen=size)
+
+    def record(self, seconds):
+        with self.lock:
+            self.observations.append(seconds)
+
+    def median(self):
+        with self.lock:
+            return statistics.median(self.observations) if self.observations else None
+
+    def clear(self):
+        with self.lock:
+            self.observations.clear()
+
+
+# shared by all invocations handled by this container
+propagation_history = PropagationHistory()
+
+
+class PollingStrategy(object):
+    """
+    exponential backoff with full jitter for polling the status of a change token.
+
+    The first probe is short, or near the median of the observed propagation times if there are any. Every next
+    delay is drawn uniformly from [0, min(cap, first_probe * factor ** attempt)]. Polling stops once the total
+    `deadline` has passed.
+    """
+
+    def __init__(self, first_probe=5.0, factor=2.0, cap=30.0, deadline=450.0, history=propagation_history,
+                 rand=random.random):
+        self.first_probe = first_probe
+        self.factor = factor
+        self.cap = cap
+        self.deadline = deadline
+        self.history = history
+        self.rand = rand
+
+    def delay(self, attempt):
+        """
+        returns the number of seconds to wait before the next poll, after `attempt` unsuccessful polls.
+        """
+        if attempt == 0:
+            median = self.history.median() if self.history is not None else None
+            return min(self.cap, max(self.first_probe, median or 0))
+        return self.rand() * min(self.cap, self.first_probe * self.factor ** attempt)
+
+    def expired(self, started, now):
+        return now - started >= self.deadline
+
+    def record(self, seconds):
+        if self.history is not None:
+            self.history.record(seconds)
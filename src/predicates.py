@@ -0,0 +1,27 @@
+def predicate_key(predicate):
+    """
+    returns the identity of `predicate` in a rule, the same for the resource properties and the live rule.
+    """
+    return predicate.get('DataId'), predicate.get('Type'), predicate.get('Negated')
+
+
+def diff_predicates(old_predicates, new_predicates):
+    """
+    returns the minimal lists of predicates to delete and to insert to turn `old_predicates` into `new_predicates`,
+    in linear time. A predicate which changed its Type or Negated flag is deleted and inserted again.
+    """
+    old = {predicate_key(p): p for p in old_predicates}
+    new = {predicate_key(p): p for p in new_predicates}
+
+    deletes = [p for key, p in old.items() if key not in new]
+    inserts = [p for key, p in new.items() if key not in old]
+    return deletes, inserts
+
+
+def chunk_updates(updates, size):
+    """
+    splits the rule `updates` in chunks of at most `size` updates, with all deletes before the inserts. Returns a
+    single empty chunk if there are no updates.
+    """
+    ordered = [u for u in updates if u['Action'] == 'DELETE'] + [u for u in updates if u['Action'] != 'DELETE']
+    return [ordered[i:i + size] for i in range(0, len(ordered), size)] or [[]]
@@ -0,0 +1,68 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+log = logging.getLogger(__name__)
+
+# the operation and id parameter to get the data set of each predicate type
+GETTERS = {
+    'IPMatch': ('get_ip_set', 'IPSetId'),
+    'ByteMatch': ('get_byte_match_set', 'ByteMatchSetId'),
+    'SqlInjectionMatch': ('get_sql_injection_match_set', 'SqlInjectionMatchSetId'),
+    'GeoMatch': ('get_geo_match_set', 'GeoMatchSetId'),
+    'SizeConstraint': ('get_size_constraint_set', 'SizeConstraintSetId'),
+    'XssMatch': ('get_xss_match_set', 'XssMatchSetId'),
+    'RegexMatch': ('get_regex_match_set', 'RegexMatchSetId'),
+}
+
+
+class PredicateChecker(object):
+    """
+    checks that the data sets referenced by predicates exist before any change is made, concurrently on a thread
+    pool. Data sets found to exist are remembered for the lifetime of the container.
+    """
+
+    def __init__(self, client, max_workers=8):
+        self.client = client
+        self.max_workers = max_workers
+        self.existing = set()
+        self.lock = threading.Lock()
+        self.executor = None
+
+    def exists(self, key):
+        predicate_type, data_id = key
+        operation, parameter = GETTERS[predicate_type]
+        try:
+            getattr(self.client, operation)(**{parameter: data_id})
+        except ClientError as error:
+            code = error.response.get('Error', {}).get('Code')
+            if code == 'WAFNonexistentItemException':
+                return False
+            if code == 'AccessDeniedException':
+                log.warning('Not allowed to %s, assuming %s %s exists.', operation, predicate_type, data_id)
+                return True
+            raise
+        return True
+
+    def missing(self, predicates):
+        """
+        returns the predicates whose data set does not exist.
+        """
+        keys = {(p['Type'], p['DataId']) for p in predicates if p.get('Type') in GETTERS and p.get('DataId')}
+        with self.lock:
+            unknown = sorted(keys - self.existing)
+            if unknown and self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        if not unknown:
+            return []
+
+        found = dict(zip(unknown, self.executor.map(self.exists, unknown)))
+        with self.lock:
+            self.existing.update(key for key, exists in found.items() if exists)
+        return [p for p in predicates if not found.get((p.get('Type'), p.get('DataId')), True)]
+
+    def clear(self):
+        with self.lock:
+            self.existing.clear()
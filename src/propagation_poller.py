@@ -0,0 +1,116 @@
+import logging
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+
+from metrics import metrics
+
+log = logging.getLogger(__name__)
+
+
+class PropagationTimeout(Exception):
+    pass
+
+
+class WatchedToken(object):
+    __slots__ = ('change_token', 'strategy', 'attempt', 'started', 'due', 'future')
+
+    def __init__(self, change_token, strategy, attempt, started):
+        self.change_token = change_token
+        self.strategy = strategy
+        self.attempt = attempt
+        self.started = started
+        self.due = time.time()
+        self.future = Future()
+
+
+class PropagationPoller(object):
+    """
+    polls all outstanding change tokens of the container from a single background thread. Every token is polled with
+    the backoff of its own polling strategy, and `watch` returns a future which resolves when the token is INSYNC,
+    or fails when its deadline has passed or its status cannot be read. The thread is restarted by `watch` if it died.
+    """
+
+    def __init__(self, client, tick=1.0, grace=30.0):
+        self.client = client
+        self.tick = tick
+        self.grace = grace
+        self.condition = threading.Condition()
+        self.watched = []
+        self.thread = None
+
+    def watch(self, change_token, strategy, attempt=0, started=None):
+        """
+        returns a future of the number of seconds between `started` and `change_token` being INSYNC.
+        """
+        token = WatchedToken(change_token, strategy, attempt, time.time() if started is None else started)
+        with self.condition:
+            self.watched.append(token)
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name='propagation-poller', daemon=True)
+                self.thread.start()
+            self.condition.notify()
+        return token.future
+
+    def wait(self, change_token, strategy, attempt=0, started=None):
+        """
+        waits until `change_token` is INSYNC, and returns the number of seconds since `started`. Gives up with a
+        PropagationTimeout if the poller has not answered within `grace` seconds after the deadline of the `strategy`.
+        """
+        started = time.time() if started is None else started
+        future = self.watch(change_token, strategy, attempt, started)
+        timeout = max(0.0, strategy.deadline - (time.time() - started)) + self.grace
+        try:
+            return future.result(timeout=timeout)
+        except TimeoutError:
+            raise PropagationTimeout(f'Change token {change_token} was not polled within {timeout:.0f} seconds.')
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.watched:
+                    self.condition.wait()
+                now = time.time()
+                due = [token for token in self.watched if token.due <= now]
+                next_due = min(token.due for token in self.watched)
+
+            if not due:
+                # sleep in short slices, so that newly watched tokens are picked up soon
+                delay = min(self.tick, next_due - now)
+                time.sleep(delay)
+                metrics.record_sleep(delay)
+                continue
+
+            for token in due:
+                self.poll(token)
+
+    def poll(self, token):
+        try:
+            status = self.client.get_change_token_status(ChangeToken=token.change_token)['ChangeTokenStatus']
+        except Exception as error:
+            # any error, such as a connection failure, fails the watch of this token only
+            self.resolve(token, exception=error)
+            return
+
+        now = time.time()
+        if status == 'INSYNC':
+            self.resolve(token, result=now - token.started)
+            return
+
+        delay = token.strategy.delay(token.attempt)
+        if token.strategy.expired(token.started, now + delay):
+            self.resolve(token, exception=PropagationTimeout(
+                f'Change token not INSYNC within {token.strategy.deadline} seconds, something must have gone wrong.'))
+            return
+
+        log.info('Change token %s is %s, polling again in %.1f seconds.', token.change_token, status, delay)
+        token.attempt += 1
+        token.due = now + delay
+
+    def resolve(self, token, result=None, exception=None):
+        with self.condition:
+            self.watched.remove(token)
+        if exception is not None:
+            token.future.set_exception(exception)
+        else:
+            token.future.set_result(result)
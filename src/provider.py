@@ -1,8 +1,29 @@
+import json
+import logging
+
+import audit
 import rate_based_rule_provider
+import rate_based_rule_set_provider
+import verifier
+import web_acl_rate_based_rule_attachment_provider
+
+log = logging.getLogger(__name__)
 
 
 def handler(request, context):
-    if request['ResourceType'] == 'Custom::RateBasedRule':
+    if 'Records' in request:
+        # continuations of requests waiting for a change token, delivered by the continuation queue
+        for record in request['Records']:
+            handler(json.loads(record['body']), context)
+    elif 'WafVerification' in request:
+        return verifier.handler(request, context)
+    elif 'WafAudit' in request:
+        return audit.handler(request, context)
+    elif request['ResourceType'] == 'Custom::RateBasedRule':
         return rate_based_rule_provider.handler(request, context)
+    elif request['ResourceType'] == 'Custom::RateBasedRuleSet':
+        return rate_based_rule_set_provider.handler(request, context)
+    elif request['ResourceType'] == 'Custom::WebACLRateBasedRuleAttachment':
+        return web_acl_rate_based_rule_attachment_provider.handler(request, context)
     else:
-        print(f"Unknown resource type: {request['ResourceType']}")
+        log.error('Unknown resource type: %s', request['ResourceType'])
@@ -1,261 +1,608 @@
 from cfn_resource_provider import ResourceProvider
 import boto3
+import asyncio
+import json
+import math
 import time
-from botocore.exceptions import ClientError
+from botocore.exceptions import BotoCoreError, ClientError
 import logging
+import logs
 import os
+from polling import PollingStrategy
+import checkpoints as checkpoint_stores
+from predicates import chunk_updates, diff_predicates
+from rules import RULE_SCHEMA, Rule, compile_schema
+from propagation_poller import PropagationTimeout
+from scopes import SERVICES, WafScope, WafScopes
+import engine
+from metrics import InstrumentedClient, metrics
+from throttling import RetryingClient
+from clients import ClientPool, LazyClient
+from botocore.config import Config
 
 log = logging.getLogger()
-log.setLevel(os.environ.get('LOG_LEVEL', 'DEBUG'))
+logs.configure(log, os.environ.get('LOG_LEVEL', 'INFO'))
 
-client = boto3.client('waf')
 
+def waf_config():
+    """
+    returns the configuration of the WAF clients: a connection pool sized for the engine and pre-flight threads, kept
+    alive between warm invocations where the botocore of the runtime supports TCP keep-alive. Retries are left to the
+    RetryingClient, which shares a rate limiter between all calls in this container.
+    """
+    options = {'retries': {'total_max_attempts': 1},
+               'max_pool_connections': int(os.environ.get('MAX_POOL_CONNECTIONS', '20'))}
+    if 'tcp_keepalive' in Config.OPTION_DEFAULTS:
+        options['tcp_keepalive'] = True
+    return Config(**options)
 
-class RateBasedRuleProvider(ResourceProvider):
-    def __init__(self):
-        super(RateBasedRuleProvider, self).__init__()
-        self.request_schema = {
-            'type': 'object',
-            'required': ['Name', 'MetricName', 'RateKey', 'RateLimit'],
-            'properties': {
-                'Name': {'type': 'string'},
-                'MetricName': {'type': 'string'},
-                'RateKey': {'type': 'string'},
-                'RateLimit': {'type': 'integer'},
-                'MatchPredicates': {
-                    'Negated': {'type': 'boolean'},
-                    'Type': {'type': 'string',
-                             'description': 'IPMatch | ByteMatch | SqlInjectionMatch | GeoMatch | SizeConstraint | '
-                                            'XssMatch | RegexMatch'},
-                    'DataId': {'type': 'string'}
-                }
-            }
-        }
 
-    def create(self):
-        kwargs = self.properties.copy()
+WAF_CONFIG = waf_config()
+clients = ClientPool(lambda service, region: boto3.client(service, region_name=region, config=WAF_CONFIG))
+lambda_client = LazyClient(lambda: boto3.client('lambda'))
+sqs_client = LazyClient(lambda: boto3.client('sqs'))
+checkpoints = checkpoint_stores.default_store()
 
-        try:
-            kwargs.pop('ServiceToken', None)
-            kwargs.pop('MatchPredicates', None)
 
-            kwargs.update({'ChangeToken': client.get_change_token()['ChangeToken']})
-            response = client.create_rate_based_rule(**kwargs)
+def create_scope(scope, region):
+    client = RetryingClient(InstrumentedClient(clients.get(SERVICES[scope], region)))
+    # change tokens are issued per service and region, so each scope and region has its own lease
+    lock_id = 'waf-change-token' if scope == 'Global' else f'waf-regional-change-token/{region}'
+    return WafScope(client, lock_id=lock_id,
+                    rule_index_ttl=float(os.environ.get('RULE_INDEX_TTL', '60')),
+                    preflight_workers=int(os.environ.get('PREFLIGHT_WORKERS', '8')))
 
-            self.physical_resource_id = response['Rule']['RuleId']
 
-            self.wait_on_status(response['ChangeToken'], current_retry=0)   # wait for the rule to finish creating
+scopes = WafScopes(create_scope)
 
-            print(f'properties_before_create: {self.properties}')
+# when set, the provider waits for a change token by sending the continuation of the request to this queue, delayed by
+# the polling delay, instead of waiting in the invocation. The queue triggers the provider again
+CONTINUATION_QUEUE_URL = os.environ.get('CONTINUATION_QUEUE_URL')
 
-            if self.response['Status'] == 'SUCCESS':
-                if 'MatchPredicates' in self.properties:   # check if the rule needs to be updated with predicate(s)
-                    print('Predicate(s) detected in create request. Also updating the rule.')
+# the maximum delay of an SQS message
+MAX_DELAY_SECONDS = 900
 
-                    update = {'RuleId': self.physical_resource_id}
-                    update.update({'RateLimit': self.properties['RateLimit']})
+# the maximum number of predicate updates sent in a single update_rate_based_rule request
+MAX_UPDATES_PER_REQUEST = int(os.environ.get('MAX_UPDATES_PER_REQUEST', '10'))
 
-                    predicates = []
-                    for predicate in self.properties['MatchPredicates']:
-                        predicates.append({
-                            'Action': 'INSERT',
-                            'Predicate': predicate
-                        })
-                    update.update({'Updates': predicates})
 
-                    self.execute_update(update)
+# phases after which not all changes have been sent yet, so a resumed request continues the operation instead of waiting
+INCOMPLETE_PHASES = {'Creating', 'RuleCreated', 'Applying'}
 
-                    if self.response['Status'] == 'SUCCESS':
-                        print('Create and update are done.')
-                        self.success('Create and update are done.')
-                    else:
-                        print('Updating the created rule failed.')
-                        self.fail('Updating the created rule failed.')
+
+def is_nonexistent_item(error):
+    return error.response.get('Error', {}).get('Code') == 'WAFNonexistentItemException'
+
+
+class RateBasedRuleProvider(ResourceProvider):
+    def __init__(self):
+        super(RateBasedRuleProvider, self).__init__()
+        self.polling_strategy = PollingStrategy()
+        self.request_schema = RULE_SCHEMA
+        self.checkpoint = {}
+        self.checkpointed = False
+
+    def handle(self, request, context):
+        metrics.reset()
+        logs.correlation.id = request.get('RequestId')
+        try:
+            response = super(RateBasedRuleProvider, self).handle(request, context)
+            if not self.asynchronous and self.checkpointed:
+                try:
+                    checkpoints.delete(self.checkpoint_key)
+                except (ClientError, BotoCoreError) as error:
+                    # the response has been sent, an error would only make Lambda retry the request
+                    log.warning('Could not delete the checkpoint %s: %s', self.checkpoint_key, error)
+            return response
+        finally:
+            metrics.emit(request.get('RequestType'),
+                         ResourceType=request.get('ResourceType'),
+                         RuleId=self.physical_resource_id,
+                         Phase=self.completed_phase,
+                         Asynchronous=self.asynchronous)
+
+    def create(self):
+        try:
+            self.resume()
+            if self.asynchronous or self.status == 'FAILED':
+                return
+
+            if self.completed_phase in (None, 'Creating', 'RuleCreated'):
+                if self.completed_phase in (None, 'Creating'):
+                    missing, rule = engine.run(self.prepare_create())
+                    if not self.report_missing(missing):
+                        return
+
+                    if rule is not None:
+                        self.adopt(rule)
+                        return
+
+                    self.save_checkpoint('Creating', [])
+                    self.physical_resource_id, change_token = self.send_create(self.properties)
+                    change_tokens = [change_token]
+                    self.save_checkpoint('RuleCreated', change_tokens)
+                    predicates = self.properties.get('MatchPredicates', [])
+                    log.debug('Created rule %s', self.physical_resource_id, extra={'properties': self.properties})
                 else:
-                    print('Create is done.')
-                    self.success('Create is done.')
+                    # the rule was created by an earlier attempt, only insert the predicates it does not have yet
+                    change_tokens = self.pending_change_tokens
+                    rule = self.waf.client.get_rate_based_rule(RuleId=self.physical_resource_id)['Rule']
+                    _, predicates = diff_predicates(rule.get('MatchPredicates', []),
+                                                    self.properties.get('MatchPredicates', []))
+
+                # add the predicates right away, instead of waiting for the rule to finish creating first
+                if predicates:
+                    log.info('Predicate(s) detected in create request. Also updating the rule.')
+
+                    try:
+                        change_tokens.extend(self.send_inserts(self.physical_resource_id,
+                                                               dict(self.properties, MatchPredicates=predicates)))
+                    except ClientError as error:
+                        log.error('Updating the created rule failed: %s', error)
+                        self.fail('Updating the created rule failed.')
+                        return
+
+                # wait once, for the last change, and verify the earlier ones are in sync too
+                self.save_checkpoint('Created', change_tokens)
+                self.wait_on_status(change_tokens[-1], phase='Created', previous_change_tokens=change_tokens[:-1])
+                if self.asynchronous or self.status == 'FAILED':
+                    return
+
+            if 'MatchPredicates' in self.properties:
+                log.info('Create and update are done.')
+                self.success('Create and update are done.')
+            else:
+                log.info('Create is done.')
+                self.success('Create is done.')
         except ClientError as error:
-            self.physical_resource_id = 'failed-to-create'
+            # keep the id of a rule that was created, so that CloudFormation deletes it on rollback
+            if not self.physical_resource_id:
+                self.physical_resource_id = 'failed-to-create'
             self.fail(f'{error}')
 
+    async def prepare_create(self):
+        """
+        checks the predicates and, when an earlier attempt of this request started to create the rule, looks for the
+        rule it may have left behind, concurrently. Returns the predicates whose data set does not exist, and the rule
+        to adopt or None.
+        """
+        predicates = self.properties.get('MatchPredicates', [])
+        if self.completed_phase != 'Creating':
+            return await engine.call(self.waf.predicate_checker.missing, predicates), None
+        return await asyncio.gather(engine.call(self.waf.predicate_checker.missing, predicates),
+                                    engine.call(self.find_existing_rule, self.properties))
+
+    async def prepare_update(self):
+        """
+        checks the predicates and reads the live rule, concurrently. Returns the predicates whose data set does not
+        exist, and the live rule.
+        """
+        predicates = self.properties.get('MatchPredicates', [])
+        waf = self.waf
+        missing, response = await asyncio.gather(engine.call(waf.predicate_checker.missing, predicates),
+                                                 waf.async_client.get_rate_based_rule(RuleId=self.physical_resource_id))
+        return missing, response['Rule']
+
+    def check_predicates(self, predicates):
+        """
+        fails the request, before any change is made, when one of the `predicates` refers to a data set that does not
+        exist. Returns True when they all exist.
+        """
+        return self.report_missing(self.waf.predicate_checker.missing(predicates))
+
+    def report_missing(self, missing):
+        if missing:
+            self.fail('Predicate data set(s) not found: ' + ', '.join(f"{p['Type']} {p['DataId']}" for p in missing))
+            return False
+        return True
+
+    def find_existing_rule(self, properties):
+        """
+        returns the live rule with the Name, MetricName and RateKey of `properties`, or None.
+        """
+        for rule_id in self.waf.rule_index.ids(properties['Name']):
+            try:
+                rule = self.waf.client.get_rate_based_rule(RuleId=rule_id)['Rule']
+            except ClientError as error:
+                if is_nonexistent_item(error):
+                    self.waf.rule_index.invalidate()
+                    continue
+                raise
+            if Rule.from_dict(rule).definition == Rule.from_dict(properties).definition:
+                return rule
+        return None
+
+    def adopt(self, rule):
+        """
+        adopts the `rule` which an earlier attempt of this request created, but did not record, instead of creating
+        a new one, and brings its rate limit and predicates up to date.
+        """
+        log.info('Adopting the existing rule %s named %s.', rule['RuleId'], rule['Name'])
+        self.physical_resource_id = rule['RuleId']
+        if Rule.from_dict(rule).state == Rule.from_dict(self.properties).state:
+            self.success('Adopted the existing rule.')
+            return
+
+        update_request = self.create_update_request(rule.get('MatchPredicates', []),
+                                                    self.properties.get('MatchPredicates', []))
+        if update_request is not None:
+            self.execute_update(update_request, phase='Created')
+
     def update(self):
-        self.convert_properties(self.old_properties)    # also convert the old properties
-        old_predicates = self.old_properties['MatchPredicates'] if 'MatchPredicates' in self.old_properties else {}
-        print(f'old_predicates: {old_predicates}')
-        print(f'new_predicates: {self.properties}')
+        if self.scope_changed or \
+                Rule.from_dict(self.old_properties).definition != Rule.from_dict(self.properties).definition:
+            # the rule cannot move, nor change its name, metric name or rate key: create a new one, CloudFormation
+            # deletes the old one
+            self.create()
+            return
+
+        if self.continuation:
+            self.resume()
+            return
+
+        if Rule.from_dict(self.old_properties).state == Rule.from_dict(self.properties).state:
+            log.info('Rate limit and predicates are unchanged, nothing to update.')
+            self.success('Nothing to update.')
+            return
+
+        try:
+            missing, rule = engine.run(self.prepare_update())
+        except ClientError as error:
+            self.fail(f'{error}')
+            return
+
+        if not self.report_missing(missing):
+            return
+
+        if Rule.from_dict(rule).state == Rule.from_dict(self.properties).state:
+            log.info('The rule is already up to date.')
+            self.success('The rule is already up to date.')
+            return
+
+        old_predicates = rule.get('MatchPredicates', [])    # diff against the live predicates of the rule
+        log.debug('Updating rule %s', self.physical_resource_id,
+                  extra={'old_predicates': old_predicates, 'properties': self.properties})
 
         new_predicates = self.properties['MatchPredicates'] if 'MatchPredicates' in self.properties else {} # get new predicates from request
 
         update_request = self.create_update_request(old_predicates, new_predicates)
-        self.execute_update(update_request)
+        if update_request is not None:
+            self.execute_update(update_request, phase='Updated')
 
     def delete(self):
-        # Check for predicates, if so delete them first
-        if 'MatchPredicates' in self.properties:
-            update = {'RuleId': self.physical_resource_id}
-            update.update({'RateLimit': self.properties['RateLimit']})
-
-            predicates = []
-            for predicate in self.properties['MatchPredicates']:
-                predicates.append({
-                    'Action': 'DELETE',
-                    'Predicate': predicate
-                })
-            update.update({'Updates': predicates})
-            self.execute_update(update, remove_all=True)
-
-        # Perform the deletion of the rule
-        try:
-            delete_request = {'RuleId': self.physical_resource_id}
-            delete_request.update({'ChangeToken': client.get_change_token()['ChangeToken']})
-            response = client.delete_rate_based_rule(**delete_request)
+        self.resume()
+        if self.asynchronous or self.status == 'FAILED':
+            return
 
-            self.wait_on_status(response['ChangeToken'], current_retry=0)   # wait for the rule to finish deleting
-
-            if self.response['Status'] == 'SUCCESS':
-                print('Delete is done.')
-                self.success('Delete is done.')
-        except ClientError as error:
-            if 'WAFNonexistentItemException' in error.response['__type']:
-                self.success()
-            else:
-                self.fail(f'{error}')
+        if self.completed_phase is None:
+            try:
+                rule = self.waf.client.get_rate_based_rule(RuleId=self.physical_resource_id)['Rule']
+            except ClientError as error:
+                if is_nonexistent_item(error):
+                    log.info('Rule %s does not exist, nothing to delete.', self.physical_resource_id)
+                    self.success()
+                else:
+                    self.fail(f'{error}')
+                return
 
-    def create_update_request(self, old_predicates, new_predicates):
-        def find_old_predicate(new_pred, old_preds):
-            for old_pred in old_preds:
-                if new_pred['DataId'] == old_pred['DataId']:
-                    return old_pred
+            try:
+                change_tokens = self.send_delete(rule)
+            except ClientError as error:
+                if is_nonexistent_item(error):
+                    self.success()
                 else:
-                    return None
-
-        def missing_fields(kwargs):
-            required_fields = ['Negated', 'Type', 'DataId']
-            return set(required_fields) - set(kwargs)
-
-        deletes = []
-        inserts = []
-
-        # check for each predicate if it already exists, if so delete it and insert a new one
-        for new_predicate in new_predicates:
-            missing = missing_fields(new_predicate)
-            print(f'missing ==>> {missing}')
-            if not missing:
-                old_predicate = find_old_predicate(new_predicate, old_predicates)
-                print(f'old_predicate ==>> {old_predicate}')
-                old_predicates = [p for p in old_predicates if p != old_predicate]  # remove from predicate list
-                if old_predicate is not None and new_predicate != old_predicate:
-                    deletes.append({
-                        'Action': 'DELETE',
-                        'Predicate': old_predicate
-                    })
-                    inserts.append({
-                        'Action': 'INSERT',
-                        'Predicate': new_predicate
-                    })
-                elif old_predicate is None:
-                    inserts.append({
-                        'Action': 'INSERT',
-                        'Predicate': new_predicate
-                    })
-            else:
-                self.fail(f'Predicate {new_predicate} is missing required fields: {missing}')
+                    self.fail(f'{error}')
                 return
 
-        # delete any predicates that are no longer present in the update request
-        for old_predicate in old_predicates:
-            deletes.append({
-                'Action': 'DELETE',
-                'Predicate': old_predicate
-            })
+            self.save_checkpoint('Deleted', change_tokens)
+            self.wait_on_status(change_tokens[-1], phase='Deleted', previous_change_tokens=change_tokens[:-1])
+            if self.asynchronous or self.status == 'FAILED':
+                return
+
+        log.info('Delete is done.')
+        self.success('Delete is done.')
+
+    def create_update_request(self, old_predicates, new_predicates):
+        deletes, inserts = diff_predicates(old_predicates, new_predicates)
 
-        print(f'delete_set: {deletes}')
-        print(f'insert_set: {inserts}')
+        log.info('Deleting %d and inserting %d predicates.', len(deletes), len(inserts))
+        log.debug('Predicate diff', extra={'deletes': deletes, 'inserts': inserts})
 
         update_request = {'RuleId': self.physical_resource_id}
         update_request.update({'RateLimit': self.properties['RateLimit']})
 
         if deletes or inserts:
-            merged_list = list(deletes + inserts)   # merge delete and insert set
+            merged_list = [{'Action': 'DELETE', 'Predicate': p} for p in deletes] + \
+                          [{'Action': 'INSERT', 'Predicate': p} for p in inserts]
             update_request.update({'Updates': merged_list})
 
         return update_request
 
-    def execute_update(self, update_request, remove_all=False):
+    def execute_update(self, update_request, phase=None):
         try:
-            update_request.update({'ChangeToken': client.get_change_token()['ChangeToken']})
-            print(f'updates: {update_request}')
-            response = client.update_rate_based_rule(**update_request)
+            log.debug('Sending update request', extra={'update_request': update_request})
+            change_tokens = self.send_updates(update_request)
+            self.save_checkpoint(phase, change_tokens)
 
-            status = self.wait_on_status(response['ChangeToken'], current_retry=0)   # wait for the rule to finish updating
+            # wait for the rule to finish updating
+            status = self.wait_on_status(change_tokens[-1], phase=phase, previous_change_tokens=change_tokens[:-1])
 
             return status
         except ClientError as error:
-            if 'WAFNonexistentItemException' in error.response["__type"] and remove_all:
-                self.success()
-            else:
-                self.fail(f'{error}')
+            self.fail(f'{error}')
 
-    def wait_on_status(self, change_token, current_retry, interval=30, max_interval=30, max_retries=15):
-        try:
-            response = client.get_change_token_status(ChangeToken=change_token)
+    def send_create(self, properties):
+        """
+        creates a rule with the `properties`, without its predicates and without waiting for it to be in sync. Returns
+        the rule id and the change token.
+        """
+        kwargs = {name: properties[name] for name in ['Name', 'MetricName', 'RateKey', 'RateLimit']}
+        waf = self.waf
+        response = waf.coordinator.mutate(lambda token: waf.client.create_rate_based_rule(ChangeToken=token, **kwargs))
+        self.waf.rule_index.invalidate()
+        return response['Rule']['RuleId'], response['ChangeToken']
+
+    def send_inserts(self, rule_id, properties):
+        """
+        inserts the MatchPredicates of the `properties` into the rule `rule_id`. Returns the change tokens.
+        """
+        update = {'RuleId': rule_id}
+        update.update({'RateLimit': properties['RateLimit']})
+        update.update({'Updates': [{'Action': 'INSERT', 'Predicate': predicate}
+                                   for predicate in properties.get('MatchPredicates', [])]})
+        return self.send_updates(update)
+
+    def send_delete(self, rule):
+        """
+        removes the predicates of the live `rule` and deletes it back to back, without waiting for the changes to be
+        in sync. Returns the change tokens.
+        """
+        change_tokens = []
+        if rule.get('MatchPredicates'):
+            update = {'RuleId': rule['RuleId']}
+            update.update({'RateLimit': rule['RateLimit']})
+            update.update({'Updates': [{'Action': 'DELETE', 'Predicate': predicate}
+                                       for predicate in rule['MatchPredicates']]})
+            change_tokens.extend(self.send_updates(update))
+
+        waf = self.waf
+        response = waf.coordinator.mutate(lambda token: waf.client.delete_rate_based_rule(RuleId=rule['RuleId'],
+                                                                                          ChangeToken=token))
+        self.waf.rule_index.invalidate()
+        change_tokens.append(response['ChangeToken'])
+        return change_tokens
+
+    def send_updates(self, update_request):
+        """
+        sends the `Updates` of the `update_request` in chunks of at most MAX_UPDATES_PER_REQUEST, deletes first. The
+        change token for the next chunk is requested as soon as the previous one is used, without waiting for it to be
+        in sync. Returns the change tokens of all chunks.
+        """
+        waf = self.waf
+        change_tokens = []
+        chunks = chunk_updates(update_request.get('Updates', []), MAX_UPDATES_PER_REQUEST)
+        for i, chunk in enumerate(chunks):
+            started = time.time()
+            response = waf.coordinator.mutate(
+                lambda token: waf.client.update_rate_based_rule(RuleId=update_request['RuleId'],
+                                                                RateLimit=update_request['RateLimit'],
+                                                                Updates=chunk,
+                                                                ChangeToken=token))
+            change_tokens.append(response['ChangeToken'])
+            log.info('Sent chunk %d/%d of %d updates in %.3f seconds.', i + 1, len(chunks), len(chunk),
+                     time.time() - started)
+        return change_tokens
+
+    def wait_on_status(self, change_token, phase=None, attempt=0, started=None, previous_change_tokens=()):
+        """
+        waits until `change_token` is INSYNC, using the polling strategy, and then verifies that the
+        `previous_change_tokens` are INSYNC as well. Returns True when they are. The tokens are polled by the shared
+        poller of the container. In asynchronous wait mode, the wait is continued in a new invocation which resumes
+        the operation after `phase`, and False is returned. In the Acknowledge propagation mode, the tokens are verified
+        by a detached invocation and True is returned right away.
+        """
+        strategy = self.polling_strategy
+        started = time.time() if started is None else started
+        pending = [change_token] + list(previous_change_tokens)
+        if self.propagation_mode == 'Acknowledge' and hasattr(self.context, 'invoked_function_arn'):
+            self.verify_asynchronously(pending, started)
+            self.success()
+            return True
 
-            if response['ChangeTokenStatus'] != 'INSYNC':
-                if current_retry >= max_retries:
-                    print(f'Max reties ({max_retries}) reached, something must have gone wrong. '
-                          f"Current status: {response['ChangeTokenStatus']}.")
-                    self.fail(f'Max retries ({max_retries}) reached, something must have gone wrong.')
-                else:
-                    print(f"Not done, current status is: {response['ChangeTokenStatus']}. "
-                          f'Waiting {interval} seconds before retrying.')
-                    time.sleep(interval)
-                    self.wait_on_status(change_token,
-                                               current_retry=current_retry + 1,
-                                               interval=min(interval + interval, max_interval))
+        try:
+            if self.is_async_wait:
+                while pending:
+                    response = self.waf.client.get_change_token_status(ChangeToken=pending[0])
+                    if response['ChangeTokenStatus'] == 'INSYNC':
+                        pending.pop(0)
+                        continue
+
+                    delay = strategy.delay(attempt)
+                    if strategy.expired(started, time.time() + delay):
+                        raise PropagationTimeout(f'Change token not INSYNC within {strategy.deadline} seconds, '
+                                                 'something must have gone wrong.')
+
+                    log.info('Not done, current status is: %s. Continuing in a new invocation in %.1f seconds.',
+                             response['ChangeTokenStatus'], delay)
+                    self.continue_asynchronously(pending, phase, attempt + 1, started, delay)
+                    return False
             else:
-                self.success()
-        except ClientError as error:
-            self.physical_resource_id = 'failed-to-create'
+                # the last change is the slowest, the earlier ones are usually in sync by the time it is
+                for i, pending_change_token in enumerate(pending):
+                    self.waf.poller.wait(pending_change_token, strategy, attempt if i == 0 else 0, started)
+        except PropagationTimeout as error:
+            log.error('%s', error)
+            self.fail(f'{error}')
+            return False
+        except (ClientError, BotoCoreError) as error:
+            if not self.physical_resource_id:
+                self.physical_resource_id = 'failed-to-create'
             self.fail(f'{error}')
+            return False
+
+        strategy.record(time.time() - started)
+        metrics.record_time_to_in_sync(time.time() - started)
+        self.success()
+        return True
+
+    @property
+    def waf(self):
+        """
+        returns the WAF scope and region selected by the Scope and Region properties of the request.
+        """
+        return scopes.get(self.properties.get('Scope', 'Global'), self.properties.get('Region'))
+
+    @property
+    def scope_changed(self):
+        """
+        returns True when an update moves the resource to another WAF scope or region, which replaces it.
+        """
+        return self.request_type == 'Update' and \
+            scopes.key(self.old_properties.get('Scope', 'Global'), self.old_properties.get('Region')) != \
+            scopes.key(self.properties.get('Scope', 'Global'), self.properties.get('Region'))
+
+    @property
+    def propagation_mode(self):
+        return self.properties.get('PropagationMode', 'Wait')
+
+    @property
+    def is_async_wait(self):
+        return bool(CONTINUATION_QUEUE_URL) and hasattr(self.context, 'invoked_function_arn')
+
+    @property
+    def continuation(self):
+        """
+        returns the continuation payload of the invocation that scheduled this one, or the checkpoint of an earlier
+        attempt of this request, or an empty dict.
+        """
+        return self.request.get('WafContinuation') or self.checkpoint
+
+    @property
+    def completed_phase(self):
+        return self.continuation.get('Phase')
+
+    @property
+    def pending_change_tokens(self):
+        return [self.continuation['ChangeToken']] + list(self.continuation.get('PreviousChangeTokens', []))
+
+    def set_request(self, request, context):
+        super(RateBasedRuleProvider, self).set_request(request, context)
+        self.checkpoint = {}
+        self.checkpointed = bool(self.continuation)
+
+    def execute(self):
+        """
+        loads the checkpoint of an earlier attempt of this request, if any, and executes the request. The request
+        fails if the checkpoint cannot be read, as starting over could repeat the changes of the earlier attempt.
+        """
+        if 'WafContinuation' not in self.request:
+            try:
+                self.checkpoint = checkpoints.load(self.checkpoint_key) or {}
+            except (ClientError, BotoCoreError) as error:
+                log.error('Could not load the checkpoint %s: %s', self.checkpoint_key, error)
+                if not self.physical_resource_id:
+                    self.physical_resource_id = 'failed-to-create'
+                self.fail(f'Could not load the checkpoint: {error}')
+                return
+            self.checkpointed = bool(self.continuation)
+        super(RateBasedRuleProvider, self).execute()
+
+    @property
+    def checkpoint_key(self):
+        return f"{self.request.get('StackId')}/{self.logical_resource_id}/{self.request_id}"
+
+    def save_checkpoint(self, phase, change_tokens):
+        """
+        records that the changes of `phase` have been sent and `change_tokens` are outstanding, so that a repeated
+        request, after a timeout or a retry, continues from here instead of starting over. An incomplete phase is
+        recorded even without change tokens, such as Creating, right before the create is sent.
+        """
+        if not change_tokens and phase not in INCOMPLETE_PHASES:
+            return
+        checkpoints.save(self.checkpoint_key, {'Phase': phase,
+                                               'ChangeToken': change_tokens[-1] if change_tokens else None,
+                                               'PreviousChangeTokens': change_tokens[:-1],
+                                               'Attempt': 0, 'Started': time.time(),
+                                               'Data': self.response['Data'],
+                                               'PhysicalResourceId': self.physical_resource_id})
+        self.checkpointed = True
+
+    def resume(self):
+        """
+        restores the state recorded in the continuation or checkpoint, if any, and continues waiting on its change
+        tokens when all changes of its phase have been sent.
+        """
+        if self.continuation:
+            log.info('Resuming after phase %s, change token %s.', self.completed_phase,
+                     self.continuation['ChangeToken'])
+            self.response['Data'].update(self.continuation.get('Data', {}))
+            if self.continuation.get('PhysicalResourceId'):
+                self.physical_resource_id = self.continuation['PhysicalResourceId']
+            if self.completed_phase in INCOMPLETE_PHASES:
+                return
+            self.wait_on_status(self.continuation['ChangeToken'],
+                                phase=self.completed_phase,
+                                attempt=self.continuation['Attempt'],
+                                started=self.continuation['Started'],
+                                previous_change_tokens=self.continuation.get('PreviousChangeTokens', []))
+
+    def continue_asynchronously(self, change_tokens, phase, attempt, started, delay):
+        """
+        sends the continuation of this request with the pending `change_tokens` to the continuation queue, delivered
+        after `delay` seconds, and returns right away. The response to CloudFormation is sent by the invocation that
+        sees the change tokens INSYNC.
+        """
+        self.request['WafContinuation'] = {'Phase': phase, 'ChangeToken': change_tokens[0],
+                                           'PreviousChangeTokens': change_tokens[1:],
+                                           'Attempt': attempt, 'Started': started,
+                                           'Data': self.response['Data'],
+                                           'PhysicalResourceId': self.physical_resource_id}
+        if self.physical_resource_id:
+            self.request['PhysicalResourceId'] = self.physical_resource_id
+
+        sqs_client.send_message(QueueUrl=CONTINUATION_QUEUE_URL,
+                                MessageBody=json.dumps(self.request),
+                                DelaySeconds=min(MAX_DELAY_SECONDS, int(math.ceil(delay))))
+        self.asynchronous = True
+
+    def verify_asynchronously(self, change_tokens, started):
+        """
+        hands the `change_tokens` to a detached invocation of this function, which verifies that they become INSYNC
+        and reports the ones that do not, so that the change can be acknowledged to CloudFormation right away.
+        """
+        verification = {'WafVerification': {'ChangeTokens': change_tokens, 'Started': started,
+                                            'Scope': self.properties.get('Scope', 'Global'),
+                                            'Region': self.properties.get('Region')},
+                        'RequestType': self.request_type,
+                        'RequestId': self.request_id,
+                        'ResourceType': self.request.get('ResourceType'),
+                        'StackId': self.request.get('StackId'),
+                        'LogicalResourceId': self.logical_resource_id,
+                        'PhysicalResourceId': self.physical_resource_id}
+        lambda_client.invoke(FunctionName=self.context.invoked_function_arn,
+                             InvocationType='Event',
+                             Payload=json.dumps(verification).encode('utf-8'))
+        log.info('Acknowledged the change, %d change token(s) are verified in the background.', len(change_tokens))
+
+    def is_valid_request(self):
+        """
+        coerces the string values of both the new and the old properties to the types of the request schema, and
+        validates the new properties, in a single pass with a schema compiled once per container.
+        """
+        schema = compile_schema(self.request_schema)
+        schema.coerce(self.properties)
+        schema.coerce(self.old_properties)
+        error = schema.error(self.properties)
+        if error:
+            self.fail(f'invalid resource properties: {error}')
+            return False
+        return True
 
     def convert_property_types(self):
         self.convert_properties(self.properties)
 
     def convert_properties(self, properties):
-        def convert(string):
-            v = str(string)
-            if v.lower() == 'true':
-                return True
-            elif v.lower() == 'false':
-                return False
-            elif check_int(v):
-                return int(v)
-            else:
-                return v
-
-        def check_int(i):
-            try:
-                int(i)
-                return True
-            except ValueError:
-                return False
-
-        if isinstance(properties, list):
-            print(f'properties: {properties} is a list')
-            for p in properties:
-                self.convert_properties(p)
-        else:
-            for prop in properties:
-                print(f'checking prop: {prop}')
-                if isinstance(properties[prop], str):
-                    print(f'properties[prop]: {properties[prop]} is a string')
-                    properties[prop] = convert(properties[prop])
-                elif iter(prop):
-                    print(f'prop: {prop} is an iterable')
-                    self.convert_properties(properties[prop])
-                else:
-                    print('Unknown type, passing...')
-                    pass
+        compile_schema(self.request_schema).coerce(properties)
 
 
 provider = RateBasedRuleProvider()
@@ -0,0 +1,268 @@
+import logging
+import uuid
+
+from botocore.exceptions import ClientError
+
+from predicates import diff_predicates
+import engine
+import rate_based_rule_provider
+from rate_based_rule_provider import RateBasedRuleProvider
+from rules import RESOURCE_PROPERTIES, Rule
+
+log = logging.getLogger(__name__)
+
+
+class RateBasedRuleSetProvider(RateBasedRuleProvider):
+    """
+    manages a list of rate-based rules as a single resource. All creates, updates and deletes of the rules are sent
+    back to back, and only the last change is waited on.
+    """
+
+    def __init__(self):
+        super(RateBasedRuleSetProvider, self).__init__()
+        self.owned = {}
+        rule_schema = self.request_schema
+        self.request_schema = {
+            'type': 'object',
+            'required': ['Rules'],
+            'properties': {
+                **RESOURCE_PROPERTIES,
+                'Rules': {'type': 'array', 'items': rule_schema}
+            }
+        }
+
+    @property
+    def rules(self):
+        return {rule['Name']: rule for rule in self.properties['Rules']}
+
+    @property
+    def old_rules(self):
+        return {rule['Name']: rule for rule in self.old_properties.get('Rules', [])}
+
+    @property
+    def predicates(self):
+        return [p for rule in self.properties['Rules'] for p in rule.get('MatchPredicates', [])]
+
+    def is_valid_request(self):
+        if not super(RateBasedRuleSetProvider, self).is_valid_request():
+            return False
+
+        if len(self.rules) != len(self.properties['Rules']):
+            self.fail('Rule names must be unique within a rule set')
+            return False
+        return True
+
+    @property
+    def ownership_key(self):
+        return f"{self.request.get('StackId')}/{self.logical_resource_id}/{self.physical_resource_id}/rules"
+
+    def load_owned(self):
+        """
+        loads the ids of the rules this set created, by name. A rule which an interrupted attempt started to create
+        but did not record is found by name, if it is the only rule with that name. Returns False if there is no
+        record of the rules of this set.
+        """
+        record = rate_based_rule_provider.checkpoints.load(self.ownership_key)
+        owned = dict(record or {})
+        owned.update(self.response['Data'])
+        for name in [name for name, rule_id in owned.items() if rule_id is None]:
+            ids = self.waf.rule_index.ids(name)
+            if len(ids) == 1:
+                owned[name] = ids[0]
+            else:
+                del owned[name]
+        self.owned = owned
+        return record is not None
+
+    def save_owned(self, name, rule_id):
+        """
+        records that this set owns the rule `rule_id` named `name`, or that it is about to create it if `rule_id` is
+        None.
+        """
+        self.owned[name] = rule_id
+        self.store_owned()
+
+    def disown(self, rule_id):
+        self.owned = {name: owned_id for name, owned_id in self.owned.items() if owned_id != rule_id}
+        self.store_owned()
+
+    def store_owned(self):
+        # unlike a checkpoint, the record does not expire: every later update and delete of the set needs it
+        if self.owned:
+            rate_based_rule_provider.checkpoints.save(self.ownership_key, self.owned, expires=False)
+        else:
+            rate_based_rule_provider.checkpoints.delete(self.ownership_key)
+
+    def check_names(self, names):
+        """
+        fails the request, before any change is made, when one of the rules `names` to create is already in use by a
+        rule which this set does not own, as rule names must be unique in the account. Returns True when none is.
+        """
+        taken = sorted(name for name in names if name not in self.owned and self.waf.rule_index.ids(name))
+        if taken:
+            self.fail('Rate-based rule name(s) already in use: ' + ', '.join(taken))
+            return False
+        return True
+
+    def apply(self, creates, updates, deletes):
+        """
+        creates the rules `creates`, updates the rules `updates` and deletes the rules `deletes`, sending all
+        changes back to back. Returns the change tokens.
+        """
+        # read the live state of all rules to delete and update at once
+        rule_ids = list(deletes) + [rule_id for rule_id, _ in updates]
+        live_rules = engine.run(engine.get_rules(self.waf.async_client, rule_ids))
+
+        change_tokens = []
+        for rule_id in deletes:
+            if rule_id in live_rules:
+                change_tokens.extend(self.send_delete(live_rules[rule_id]))
+                self.save_checkpoint('Applying', change_tokens)
+            self.disown(rule_id)
+
+        creates = list(creates)
+        for rule_id, properties in updates:
+            if rule_id not in live_rules:
+                # the rule index was out of date, the rule no longer exists
+                creates.append(properties)
+                continue
+            rule = live_rules[rule_id]
+            if Rule.from_dict(rule).state == Rule.from_dict(properties).state:
+                continue
+            removed, added = diff_predicates(rule.get('MatchPredicates', []), properties.get('MatchPredicates', []))
+            update_request = {'RuleId': rule_id, 'RateLimit': properties['RateLimit']}
+            update_request.update({'Updates': [{'Action': 'DELETE', 'Predicate': p} for p in removed] +
+                                              [{'Action': 'INSERT', 'Predicate': p} for p in added]})
+            change_tokens.extend(self.send_updates(update_request))
+            self.save_checkpoint('Applying', change_tokens)
+
+        for properties in creates:
+            self.save_owned(properties['Name'], None)
+            rule_id, change_token = self.send_create(properties)
+            self.save_owned(properties['Name'], rule_id)
+            self.set_attribute(properties['Name'], rule_id)
+            change_tokens.append(change_token)
+            self.save_checkpoint('Applying', change_tokens)
+            if properties.get('MatchPredicates'):
+                change_tokens.extend(self.send_inserts(rule_id, properties))
+                self.save_checkpoint('Applying', change_tokens)
+
+        return change_tokens
+
+    def execute_plan(self, creates, updates, deletes, reason):
+        try:
+            change_tokens = self.apply(creates, updates, deletes)
+        except ClientError as error:
+            self.fail(f'{error}')
+            return
+
+        log.info('Applied %d creates, %d updates and %d deletes with %d changes.', len(creates), len(updates),
+                 len(deletes), len(change_tokens))
+        if change_tokens:
+            self.save_checkpoint('Applied', change_tokens)
+            self.wait_on_status(change_tokens[-1], phase='Applied', previous_change_tokens=change_tokens[:-1])
+            if self.asynchronous or self.status == 'FAILED':
+                return
+        self.success(reason)
+
+    def create(self):
+        self.resume()
+        if self.asynchronous or self.status == 'FAILED':
+            return
+
+        if self.completed_phase is None:
+            if not self.check_predicates(self.predicates):
+                return
+            self.owned = {}
+            try:
+                if not self.check_names(self.rules):
+                    return
+            except ClientError as error:
+                self.fail(f'{error}')
+                return
+            self.physical_resource_id = f'{self.logical_resource_id}-{uuid.uuid4()}'
+            self.execute_plan(list(self.rules.values()), [], [], 'Create is done.')
+        elif self.completed_phase == 'Applying':
+            # an earlier attempt created some of the rules, reconcile them with the desired ones
+            self.reconcile({}, 'Create is done.')
+        else:
+            self.success('Create is done.')
+
+    def update(self):
+        # the rules cannot move, so in another scope or region the set is created anew and the old one deleted
+        old_rules = {} if self.scope_changed else self.old_rules
+        if self.continuation:
+            self.resume()
+            if self.completed_phase == 'Applying':
+                self.reconcile(old_rules, 'Update is done.')
+            return
+
+        if self.scope_changed:
+            self.physical_resource_id = f'{self.logical_resource_id}-{uuid.uuid4()}'
+        self.reconcile(old_rules, 'Update is done.')
+
+    def reconcile(self, old_rules, reason):
+        """
+        creates, updates and deletes the rules owned by this set so that they match the desired rules, given the
+        `old_rules`. The owned rules are recorded as they are created, so a plan interrupted halfway can be reconciled
+        again.
+        """
+        rules = self.rules
+        if not self.check_predicates(self.predicates):
+            return
+        try:
+            self.load_owned()
+            if not self.check_names(set(rules) - set(self.owned)):
+                return
+        except ClientError as error:
+            self.fail(f'{error}')
+            return
+        rule_ids = dict(self.owned)
+
+        typed = {name: Rule.from_dict(rule) for name, rule in rules.items()}
+        old_typed = {name: Rule.from_dict(rule) for name, rule in old_rules.items()}
+        creates, updates, deletes = [], [], []
+        for name, rule_id in rule_ids.items():
+            if name not in rules:
+                deletes.append(rule_id)
+            elif name in old_rules and old_typed[name].definition != typed[name].definition:
+                deletes.append(rule_id)
+                creates.append(rules[name])
+            else:
+                self.set_attribute(name, rule_id)
+                if name not in old_rules or old_typed[name].state != typed[name].state:
+                    updates.append((rule_id, rules[name]))
+        creates.extend(rule for name, rule in rules.items() if name not in rule_ids)
+
+        self.execute_plan(creates, updates, deletes, reason)
+
+    def delete(self):
+        self.resume()
+        if self.asynchronous or self.status == 'FAILED':
+            return
+
+        if self.physical_resource_id in ('could-not-create', 'failed-to-create'):
+            self.success('Nothing to delete.')
+            return
+
+        if self.completed_phase in (None, 'Applying'):
+            try:
+                recorded = self.load_owned()
+            except ClientError as error:
+                self.fail(f'{error}')
+                return
+            if not recorded and self.completed_phase is None and self.rules:
+                # without the record it is unknown which rules this set created, so do not report them deleted
+                self.fail(f'No record of the rules created by rule set {self.physical_resource_id}, '
+                          'the rules have not been deleted')
+                return
+            self.execute_plan([], [], list(self.owned.values()), 'Delete is done.')
+        else:
+            self.success('Delete is done.')
+
+
+provider = RateBasedRuleSetProvider()
+
+
+def handler(request, context):
+    return provider.handle(request, context)
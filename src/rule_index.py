@@ -0,0 +1,44 @@
+import threading
+import time
+from collections import defaultdict
+
+
+class RuleIndex(object):
+    """
+    the ids of the rate-based rules in the account by name, built from the paginated list_rate_based_rules. The index
+    is cached per container for `ttl` seconds, and invalidated whenever this process creates or deletes a rule.
+    """
+
+    def __init__(self, client, ttl=60.0, page_size=100):
+        self.client = client
+        self.ttl = ttl
+        self.page_size = page_size
+        self.lock = threading.Lock()
+        self.rule_ids = None
+        self.loaded = 0.0
+
+    def load(self):
+        rule_ids = defaultdict(list)
+        kwargs = {'Limit': self.page_size}
+        while True:
+            response = self.client.list_rate_based_rules(**kwargs)
+            for rule in response.get('Rules', []):
+                rule_ids[rule['Name']].append(rule['RuleId'])
+            if not response.get('NextMarker') or not response.get('Rules'):
+                return dict(rule_ids)
+            kwargs['NextMarker'] = response['NextMarker']
+
+    def ids(self, name):
+        """
+        returns the ids of the rules named `name`, refreshing the index when it has expired.
+        """
+        with self.lock:
+            now = time.time()
+            if self.rule_ids is None or now - self.loaded >= self.ttl:
+                self.rule_ids = self.load()
+                self.loaded = now
+            return list(self.rule_ids.get(name, []))
+
+    def invalidate(self):
+        with self.lock:
+            self.rule_ids = None
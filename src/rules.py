@@ -0,0 +1,186 @@
+import json
+
+import jsonschema
+from jsonschema.exceptions import best_match
+
+from predicates import predicate_key
+
+PREDICATE_TYPES = ['IPMatch', 'ByteMatch', 'SqlInjectionMatch', 'GeoMatch', 'SizeConstraint', 'XssMatch', 'RegexMatch']
+
+PREDICATE_SCHEMA = {
+    'type': 'object',
+    'required': ['Negated', 'Type', 'DataId'],
+    'properties': {
+        'Negated': {'type': 'boolean'},
+        'Type': {'type': 'string', 'enum': PREDICATE_TYPES},
+        'DataId': {'type': 'string'}
+    }
+}
+
+# selects the WAF scope and region of a resource
+SCOPE_PROPERTIES = {
+    'Scope': {'type': 'string', 'enum': ['Global', 'Regional']},
+    'Region': {'type': 'string'}
+}
+
+# the properties which every resource of the provider supports
+RESOURCE_PROPERTIES = {
+    **SCOPE_PROPERTIES,
+    'PropagationMode': {'type': 'string', 'enum': ['Wait', 'Acknowledge']}
+}
+
+RULE_SCHEMA = {
+    'type': 'object',
+    'required': ['Name', 'MetricName', 'RateKey', 'RateLimit'],
+    'properties': {
+        **RESOURCE_PROPERTIES,
+        'Name': {'type': 'string'},
+        'MetricName': {'type': 'string'},
+        'RateKey': {'type': 'string'},
+        'RateLimit': {'type': 'integer'},
+        'MatchPredicates': {'type': 'array', 'items': PREDICATE_SCHEMA}
+    }
+}
+
+
+def field_types(schema, types=None):
+    """
+    returns the JSON type of every property in the `schema`, by property name.
+    """
+    types = {} if types is None else types
+    for name, definition in schema.get('properties', {}).items():
+        if definition.get('type') in ('integer', 'boolean'):
+            types[name] = definition['type']
+        field_types(definition, types)
+    if isinstance(schema.get('items'), dict):
+        field_types(schema['items'], types)
+    return types
+
+
+def to_integer(value):
+    digits = value[1:] if value[:1] == '-' else value
+    return int(value) if digits.isdigit() else value
+
+
+def to_boolean(value):
+    return {'true': True, 'false': False}.get(value.lower(), value)
+
+
+COERCIONS = {'integer': to_integer, 'boolean': to_boolean}
+
+
+class CompiledSchema(object):
+    """
+    a request schema with its validator and the coercion of the CloudFormation string values of its integer and
+    boolean properties, built once.
+    """
+
+    def __init__(self, schema):
+        self.validator = jsonschema.Draft4Validator(schema)
+        self.coercions = {name: COERCIONS[t] for name, t in field_types(schema).items()}
+
+    def coerce(self, properties):
+        """
+        converts the string values of the integer and boolean properties in `properties` in place, in a single pass.
+        """
+        if isinstance(properties, list):
+            for value in properties:
+                if isinstance(value, (dict, list)):
+                    self.coerce(value)
+        elif isinstance(properties, dict):
+            for name, value in properties.items():
+                if isinstance(value, str):
+                    if name in self.coercions:
+                        properties[name] = self.coercions[name](value)
+                elif isinstance(value, (dict, list)):
+                    self.coerce(value)
+        return properties
+
+    def error(self, properties):
+        """
+        returns the message of the most relevant validation error of `properties`, or None if they are valid.
+        """
+        error = best_match(self.validator.iter_errors(properties))
+        if error is None:
+            return None
+        if isinstance(error.instance, dict):
+            return error.message.replace(str(error.instance), '<instance>')
+        return error.message
+
+
+compiled_schemas = {}
+
+
+def compile_schema(schema):
+    """
+    returns the compiled `schema`, compiling it only once per container.
+    """
+    key = json.dumps(schema, sort_keys=True)
+    if key not in compiled_schemas:
+        compiled_schemas[key] = CompiledSchema(schema)
+    return compiled_schemas[key]
+
+
+class Predicate(object):
+    __slots__ = ('negated', 'type', 'data_id')
+
+    def __init__(self, negated, type, data_id):
+        self.negated = negated
+        self.type = type
+        self.data_id = data_id
+
+    @classmethod
+    def from_dict(cls, predicate):
+        return cls(predicate.get('Negated'), predicate.get('Type'), predicate.get('DataId'))
+
+    def to_dict(self):
+        return {'Negated': self.negated, 'Type': self.type, 'DataId': self.data_id}
+
+    @property
+    def key(self):
+        return predicate_key(self.to_dict())
+
+    def __eq__(self, other):
+        return isinstance(other, Predicate) and self.key == other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __repr__(self):
+        return f'Predicate({self.negated!r}, {self.type!r}, {self.data_id!r})'
+
+
+class Rule(object):
+    """
+    a rate-based rule, from the resource properties or from WAF.
+    """
+    __slots__ = ('name', 'metric_name', 'rate_key', 'rate_limit', 'predicates')
+
+    def __init__(self, name, metric_name, rate_key, rate_limit, predicates=()):
+        self.name = name
+        self.metric_name = metric_name
+        self.rate_key = rate_key
+        self.rate_limit = rate_limit
+        self.predicates = tuple(predicates)
+
+    @classmethod
+    def from_dict(cls, rule):
+        return cls(rule.get('Name'), rule.get('MetricName'), rule.get('RateKey'), rule.get('RateLimit'),
+                   [Predicate.from_dict(p) for p in rule.get('MatchPredicates') or []])
+
+    @property
+    def state(self):
+        """
+        the rate limit and predicates, the part of the rule that can be changed without replacing it.
+        """
+        return self.rate_limit, frozenset(p.key for p in self.predicates)
+
+    @property
+    def definition(self):
+        """
+        the part of the rule that cannot be changed without replacing it.
+        """
+        return self.name, self.metric_name, self.rate_key
+
+    def __repr__(self):
+        return f'Rule({self.name!r}, {self.metric_name!r}, {self.rate_key!r}, {self.rate_limit!r}, {self.predicates!r})'
@@ -0,0 +1,55 @@
+import os
+import threading
+
+import engine
+from change_token_coordinator import ChangeTokenCoordinator, default_backend
+from preflight import PredicateChecker
+from propagation_poller import PropagationPoller
+from rule_index import RuleIndex
+
+# the WAF Classic service of each scope: CloudFront distributions use the global WAF, load balancers WAF Regional
+SERVICES = {'Global': 'waf', 'Regional': 'waf-regional'}
+
+
+class WafScope(object):
+    """
+    the client of a WAF scope and region, with the change token lock, rule index, poller and predicate checker which
+    belong to it. Change tokens, rules and data sets of one scope and region are invisible to the others.
+    """
+
+    def __init__(self, client, lock_id='waf-change-token', rule_index_ttl=60.0, preflight_workers=8):
+        self.client = client
+        self.async_client = engine.AsyncClient(client)
+        self.coordinator = ChangeTokenCoordinator(client, default_backend(lock_id))
+        self.rule_index = RuleIndex(client, ttl=rule_index_ttl)
+        self.poller = PropagationPoller(client)
+        self.predicate_checker = PredicateChecker(client, max_workers=preflight_workers)
+
+
+class WafScopes(object):
+    """
+    the WAF scopes by scope and region, each created on first use by `factory(scope, region)` and shared by all
+    invocations handled by the container. The region of the global scope is ignored, and the region of a regional
+    scope defaults to the region of the function.
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.scopes = {}
+        self.lock = threading.Lock()
+
+    def key(self, scope, region):
+        if scope == 'Regional':
+            return scope, region or os.environ.get('AWS_REGION') or os.environ.get('AWS_DEFAULT_REGION')
+        return scope, None
+
+    def get(self, scope='Global', region=None):
+        key = self.key(scope, region)
+        with self.lock:
+            if key not in self.scopes:
+                self.scopes[key] = self.factory(*key)
+            return self.scopes[key]
+
+    def values(self):
+        with self.lock:
+            return list(self.scopes.values())
@@ -0,0 +1,103 @@
+import logging
+import os
+import random
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+from metrics import metrics
+
+log = logging.getLogger(__name__)
+
+# errors after which the same call may succeed when it is retried. A WAFStaleDataException needs a new change token,
+# so it is retried by the ChangeTokenCoordinator instead.
+RETRYABLE_ERRORS = {
+    'ThrottlingException',
+    'Throttling',
+    'TooManyRequestsException',
+    'RequestLimitExceeded',
+    'WAFInternalErrorException',
+    'InternalFailure',
+    'ServiceUnavailable',
+}
+
+
+def is_retryable(error):
+    return error.response.get('Error', {}).get('Code') in RETRYABLE_ERRORS
+
+
+class TokenBucket(object):
+    """
+    a client-side rate limiter allowing `rate` calls per second with bursts of up to `capacity` calls, shared by all
+    threads in the process.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self.tokens = self.capacity
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    def take(self):
+        """
+        reserves a token, and returns the number of seconds to wait before it may be used.
+        """
+        with self.lock:
+            now = time.time()
+            elapsed = max(0.0, now - self.updated)
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate) - 1
+            self.updated = now
+            return max(0.0, -self.tokens / self.rate)
+
+    def acquire(self):
+        """
+        blocks until a token is available.
+        """
+        wait = self.take()
+        if wait:
+            time.sleep(wait)
+            metrics.record_sleep(wait)
+
+
+# shared by all WAF clients in this container
+bucket = TokenBucket(rate=float(os.environ.get('WAF_CALLS_PER_SECOND', '5')))
+
+
+class RetryingClient(object):
+    """
+    wraps a boto3 client. Every call first takes a token from the shared `bucket`, and calls failing with a
+    retryable error are retried with exponential backoff and full jitter.
+    """
+
+    def __init__(self, client, bucket=bucket, max_attempts=5, base=0.5, cap=10.0):
+        self.client = client
+        self.bucket = bucket
+        self.max_attempts = max_attempts
+        self.base = base
+        self.cap = cap
+
+    def __getattr__(self, name):
+        attribute = getattr(self.client, name)
+        if not callable(attribute) or name.startswith('_') or name in ('can_paginate', 'get_paginator'):
+            return attribute
+
+        def call(*args, **kwargs):
+            attempt = 1
+            while True:
+                self.bucket.acquire()
+                try:
+                    return attribute(*args, **kwargs)
+                except ClientError as error:
+                    if not is_retryable(error) or attempt >= self.max_attempts:
+                        raise
+                    delay = random.random() * min(self.cap, self.base * 2 ** attempt)
+                    log.info('%s failed with %s, retrying in %.2f seconds (%d/%d).', name,
+                             error.response['Error']['Code'], delay, attempt, self.max_attempts)
+                    time.sleep(delay)
+                    metrics.record_retry()
+                    metrics.record_sleep(delay)
+                    attempt += 1
+
+        return call
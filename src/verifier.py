@@ -0,0 +1,53 @@
+import logging
+import time
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+import logs
+from metrics import metrics
+from polling import PollingStrategy
+from propagation_poller import PropagationTimeout
+from rate_based_rule_provider import scopes
+
+log = logging.getLogger(__name__)
+
+
+def verify(waf, change_tokens, started, strategy):
+    """
+    waits until all `change_tokens` are INSYNC, and returns the number of seconds since `started`.
+    """
+    for change_token in change_tokens:
+        waf.poller.wait(change_token, strategy, 0, started)
+    return time.time() - started
+
+
+def handler(request, context):
+    """
+    verifies that the change tokens of a change which was acknowledged to CloudFormation without waiting become
+    INSYNC. A change which does not propagate is logged as an error and counted in the PropagationFailures metric.
+    """
+    verification = request['WafVerification']
+    metrics.reset()
+    logs.correlation.id = request.get('RequestId')
+    waf = scopes.get(verification.get('Scope', 'Global'), verification.get('Region'))
+    strategy = PollingStrategy()
+    failed = True
+    try:
+        seconds = verify(waf, verification['ChangeTokens'], verification['Started'], strategy)
+        strategy.record(seconds)
+        metrics.record_time_to_in_sync(seconds)
+        log.info('The %s of %s %s is INSYNC after %.1f seconds.', request.get('RequestType'),
+                 request.get('ResourceType'), request.get('PhysicalResourceId'), seconds)
+        failed = False
+    except (PropagationTimeout, ClientError, BotoCoreError) as error:
+        log.error('The %s of %s %s did not propagate: %s', request.get('RequestType'), request.get('ResourceType'),
+                  request.get('PhysicalResourceId'), error)
+    finally:
+        metrics.record_propagation(failed)
+        metrics.emit('Verify',
+                     ResourceType=request.get('ResourceType'),
+                     RequestType=request.get('RequestType'),
+                     StackId=request.get('StackId'),
+                     LogicalResourceId=request.get('LogicalResourceId'),
+                     PhysicalResourceId=request.get('PhysicalResourceId'))
+    return {'Status': 'FAILED' if failed else 'INSYNC', 'ChangeTokens': verification['ChangeTokens']}
@@ -0,0 +1,213 @@
+import asyncio
+import logging
+import uuid
+
+from botocore.exceptions import ClientError
+
+import engine
+from rate_based_rule_provider import RateBasedRuleProvider, is_nonexistent_item
+from rules import RESOURCE_PROPERTIES
+
+log = logging.getLogger(__name__)
+
+ATTACHMENT_SCHEMA = {
+    'type': 'object',
+    'required': ['RuleId', 'Priority', 'Action'],
+    'properties': {
+        'RuleId': {'type': 'string'},
+        'Priority': {'type': 'integer'},
+        'Action': {
+            'type': 'object',
+            'required': ['Type'],
+            'properties': {
+                'Type': {'type': 'string', 'enum': ['BLOCK', 'ALLOW', 'COUNT']}
+            }
+        }
+    }
+}
+
+
+def activated_rule(attachment):
+    """
+    returns the ActivatedRule of a web ACL for the `attachment` of a rate-based rule.
+    """
+    return {'Priority': attachment['Priority'], 'RuleId': attachment['RuleId'],
+            'Action': {'Type': attachment['Action']['Type']}, 'Type': 'RATE_BASED'}
+
+
+def comparable(rule):
+    """
+    returns the live activated `rule` without the fields which do not apply to rate-based rules.
+    """
+    return {'Priority': rule.get('Priority'), 'RuleId': rule.get('RuleId'),
+            'Action': {'Type': rule.get('Action', {}).get('Type')}, 'Type': rule.get('Type')}
+
+
+def diff_activated_rules(activated_rules, attachments, old_attachments=()):
+    """
+    returns the live activated rules to delete from, and the activated rules to insert into, a web ACL with the
+    `activated_rules`, so that the rules of the `attachments` are attached as requested and the rules only in the
+    `old_attachments` are detached. The other rules of the web ACL are left alone.
+    """
+    desired = {a['RuleId']: activated_rule(a) for a in attachments}
+    owned = set(desired) | {a['RuleId'] for a in old_attachments}
+    live = {r['RuleId']: r for r in activated_rules if r['RuleId'] in owned}
+
+    unchanged = {rule_id for rule_id, rule in live.items() if desired.get(rule_id) == comparable(rule)}
+
+    deletes = [rule for rule_id, rule in live.items() if rule_id not in unchanged]
+    inserts = [rule for rule_id, rule in desired.items() if rule_id not in unchanged]
+    return deletes, inserts
+
+
+class WebACLRateBasedRuleAttachmentProvider(RateBasedRuleProvider):
+    """
+    attaches rate-based rules to a web ACL. All activated rules are inserted and deleted in a single update of the
+    web ACL, so that attaching any number of rules costs one change and one wait.
+    """
+
+    def __init__(self):
+        super(WebACLRateBasedRuleAttachmentProvider, self).__init__()
+        self.request_schema = {
+            'type': 'object',
+            'required': ['WebACLId', 'Rules'],
+            'properties': {
+                **RESOURCE_PROPERTIES,
+                'WebACLId': {'type': 'string'},
+                'Rules': {'type': 'array', 'items': ATTACHMENT_SCHEMA}
+            }
+        }
+
+    @property
+    def web_acl_id(self):
+        return self.properties['WebACLId']
+
+    @property
+    def attachments(self):
+        return self.properties['Rules']
+
+    def is_valid_request(self):
+        if not super(WebACLRateBasedRuleAttachmentProvider, self).is_valid_request():
+            return False
+
+        if len({a['RuleId'] for a in self.attachments}) != len(self.attachments):
+            self.fail('RuleIds must be unique within an attachment')
+            return False
+
+        if len({a['Priority'] for a in self.attachments}) != len(self.attachments):
+            self.fail('Priorities must be unique within an attachment')
+            return False
+        return True
+
+    async def prepare(self, rule_ids):
+        """
+        reads the web ACL and the rules `rule_ids` concurrently. Returns the web ACL and the rules by id, without the
+        rules which do not exist.
+        """
+        async_client = self.waf.async_client
+        response, rules = await asyncio.gather(async_client.get_web_acl(WebACLId=self.web_acl_id),
+                                               engine.get_rules(async_client, rule_ids))
+        return response['WebACL'], rules
+
+    def attach(self, old_attachments, reason):
+        """
+        brings the activated rules of the web ACL in line with the attachments, given the `old_attachments`, in a
+        single update of the web ACL.
+        """
+        try:
+            web_acl, rules = engine.run(self.prepare([a['RuleId'] for a in self.attachments]))
+        except ClientError as error:
+            self.fail(f'{error}')
+            return
+
+        missing = [a['RuleId'] for a in self.attachments if a['RuleId'] not in rules]
+        if missing:
+            self.fail('Rate-based rule(s) not found: ' + ', '.join(missing))
+            return
+
+        deletes, inserts = diff_activated_rules(web_acl.get('Rules', []), self.attachments, old_attachments)
+        self.send_web_acl_update(deletes, inserts, reason)
+
+    def send_web_acl_update(self, deletes, inserts, reason):
+        """
+        deletes the activated rules `deletes` from the web ACL and inserts the activated rules `inserts`, in a
+        single update, and waits for it to be in sync.
+        """
+        if not deletes and not inserts:
+            log.info('The rules of web ACL %s are already up to date.', self.web_acl_id)
+            self.success(reason)
+            return
+
+        updates = [{'Action': 'DELETE', 'ActivatedRule': rule} for rule in deletes] + \
+                  [{'Action': 'INSERT', 'ActivatedRule': rule} for rule in inserts]
+        waf = self.waf
+        try:
+            response = waf.coordinator.mutate(
+                lambda token: waf.client.update_web_acl(WebACLId=self.web_acl_id, Updates=updates, ChangeToken=token))
+        except ClientError as error:
+            self.fail(f'{error}')
+            return
+
+        log.info('Deleted %d and inserted %d activated rules of web ACL %s in a single change.', len(deletes),
+                 len(inserts), self.web_acl_id)
+        change_tokens = [response['ChangeToken']]
+        self.save_checkpoint('Attached', change_tokens)
+        self.wait_on_status(change_tokens[-1], phase='Attached')
+        if self.asynchronous or self.status == 'FAILED':
+            return
+        self.success(reason)
+
+    def create(self):
+        self.resume()
+        if self.asynchronous or self.status == 'FAILED':
+            return
+
+        if self.completed_phase is None:
+            self.physical_resource_id = f'{self.logical_resource_id}-{uuid.uuid4()}'
+            self.attach([], 'Attach is done.')
+            if self.status == 'FAILED' and not self.checkpointed:
+                # nothing was attached, so there is nothing to detach on rollback
+                self.physical_resource_id = 'failed-to-create'
+        else:
+            self.success('Attach is done.')
+
+    def update(self):
+        if self.continuation:
+            self.resume()
+            return
+
+        if self.old_properties.get('WebACLId') != self.web_acl_id or self.scope_changed:
+            # attach to the new web ACL under a new id, CloudFormation deletes the attachment to the old one
+            self.physical_resource_id = f'{self.logical_resource_id}-{uuid.uuid4()}'
+            self.attach([], 'Update is done.')
+        else:
+            self.attach(self.old_properties.get('Rules', []), 'Update is done.')
+
+    def delete(self):
+        self.resume()
+        if self.asynchronous or self.status == 'FAILED':
+            return
+
+        if self.completed_phase is not None or self.physical_resource_id == 'failed-to-create':
+            self.success('Detach is done.')
+            return
+
+        try:
+            web_acl = self.waf.client.get_web_acl(WebACLId=self.web_acl_id)['WebACL']
+        except ClientError as error:
+            if is_nonexistent_item(error):
+                log.info('Web ACL %s does not exist, nothing to detach.', self.web_acl_id)
+                self.success()
+            else:
+                self.fail(f'{error}')
+            return
+
+        deletes, _ = diff_activated_rules(web_acl.get('Rules', []), [], self.attachments)
+        self.send_web_acl_update(deletes, [], 'Detach is done.')
+
+
+provider = WebACLRateBasedRuleAttachmentProvider()
+
+
+def handler(request, context):
+    return provider.handle(request, context)
@@ -0,0 +1,28 @@
+import importlib
+from contextlib import ExitStack
+
+import pytest
+from mock import patch
+
+from src.checkpoints import LocalFileCheckpointStore
+from tests.waf_simulator import VirtualClock, WafSimulator
+
+# the providers are imported both as src.<module> by the tests and as <module> by each other
+PROVIDER_MODULES = ['src.rate_based_rule_provider', 'rate_based_rule_provider']
+
+
+@pytest.fixture
+def waf(tmp_path, monkeypatch):
+    # the lambda client of the provider takes its region from the environment, as it does in Lambda
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'eu-west-1')
+    simulator = WafSimulator(propagation_delay=10, clock=VirtualClock())
+    store = LocalFileCheckpointStore(str(tmp_path))
+    with ExitStack() as stack:
+        stack.enter_context(simulator.patch())
+        for module in PROVIDER_MODULES:
+            stack.enter_context(patch(f'{module}.checkpoints', store))
+            for scope in importlib.import_module(module).scopes.values():
+                scope.rule_index.invalidate()
+                scope.predicate_checker.clear()
+        simulator.checkpoints = store
+        yield simulator
@@ -0,0 +1,53 @@
+import boto3
+
+from src.audit import audit, handler
+
+
+def create_rule(client, name, rate_limit=2000, predicates=()):
+    change_token = client.get_change_token()['ChangeToken']
+    rule_id = client.create_rate_based_rule(Name=name, MetricName=f'{name}metric', RateKey='IP', RateLimit=rate_limit,
+                                            ChangeToken=change_token)['Rule']['RuleId']
+    if predicates:
+        client.update_rate_based_rule(RuleId=rule_id, RateLimit=rate_limit,
+                                      ChangeToken=client.get_change_token()['ChangeToken'],
+                                      Updates=[{'Action': 'INSERT', 'Predicate': p} for p in predicates])
+    return rule_id
+
+
+def declared(name, rate_limit='2000', predicates=None):
+    rule = {'Name': name, 'MetricName': f'{name}metric', 'RateKey': 'IP', 'RateLimit': rate_limit}
+    if predicates is not None:
+        rule['MatchPredicates'] = predicates
+    return rule
+
+
+def test_audit(waf):
+    client = boto3.client('waf', region_name='us-east-1')
+    create_rule(client, 'in-sync', predicates=[{'Negated': False, 'Type': 'IPMatch', 'DataId': 'ip-1'}])
+    create_rule(client, 'rate-limit-changed', rate_limit=3000)
+    create_rule(client, 'predicate-added', predicates=[{'Negated': False, 'Type': 'IPMatch', 'DataId': 'ip-2'}])
+    create_rule(client, 'undeclared')
+    document = {'Rules': [declared('in-sync', predicates=[{'Negated': 'False', 'Type': 'IPMatch', 'DataId': 'ip-1'}]),
+                          declared('rate-limit-changed'),
+                          declared('predicate-added'),
+                          declared('missing')]}
+
+    reports = {report['Name']: report for report in audit(client, document, max_workers=4)}
+    assert {name: report['Status'] for name, report in reports.items()} == {
+        'in-sync': 'IN_SYNC', 'rate-limit-changed': 'DRIFTED', 'predicate-added': 'DRIFTED',
+        'undeclared': 'UNDECLARED', 'missing': 'MISSING'}
+    assert reports['rate-limit-changed']['Differences'] == {'RateLimit': {'Declared': 2000, 'Live': 3000}}
+    assert reports['predicate-added']['UndeclaredPredicates'] == [{'Negated': False, 'Type': 'IPMatch',
+                                                                   'DataId': 'ip-2'}]
+    assert document['Rules'][0]['MatchPredicates'][0]['Negated'] == 'False', 'the document is left alone'
+    assert waf.api_calls['GetRateBasedRule'] == 4
+
+
+def test_audit_action(waf):
+    client = boto3.client('waf', region_name='us-east-1')
+    for i in range(30):
+        create_rule(client, f'rule{i}')
+
+    response = handler({'WafAudit': {'Rules': [declared(f'rule{i}') for i in range(30)]}}, ())
+    assert response['Summary'] == {'IN_SYNC': 30}
+    assert len(response['Reports']) == 30
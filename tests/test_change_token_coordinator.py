@@ -0,0 +1,139 @@
+import threading
+
+import pytest
+from botocore.exceptions import ClientError
+from mock import patch
+
+from src.change_token_coordinator import ChangeTokenCoordinator, DynamoDBLockBackend, LocalLockBackend, LeaseTimeout
+
+
+def client_error(code, operation_name='UpdateRateBasedRule'):
+    return ClientError({'Error': {'Code': code, 'Message': code}}, operation_name)
+
+
+class FakeWaf(object):
+    """
+    returns the same change token until it is used, like WAF does.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.in_window = 0
+        self.max_in_window = 0
+
+    def get_change_token(self):
+        with self.lock:
+            self.in_window += 1
+            self.max_in_window = max(self.max_in_window, self.in_window)
+            return {'ChangeToken': f'token-{self.generation}'}
+
+    def update_rate_based_rule(self, ChangeToken, **kwargs):
+        threading.Event().wait(0.01)
+        with self.lock:
+            self.in_window -= 1
+            if ChangeToken != f'token-{self.generation}':
+                raise client_error('WAFStaleDataException')
+            self.generation += 1
+            return {'ChangeToken': ChangeToken}
+
+
+def test_parallel_mutations_are_serialized():
+    waf = FakeWaf()
+    coordinator = ChangeTokenCoordinator(waf, backend=LocalLockBackend())
+    responses = []
+
+    def mutate():
+        responses.append(coordinator.mutate(lambda token: waf.update_rate_based_rule(ChangeToken=token)))
+
+    threads = [threading.Thread(target=mutate) for _ in range(10)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert waf.max_in_window == 1
+    assert sorted(r['ChangeToken'] for r in responses) == sorted(f'token-{i}' for i in range(10))
+
+
+def test_file_lock_backend(tmp_path):
+    waf = FakeWaf()
+    coordinator = ChangeTokenCoordinator(waf, backend=LocalLockBackend(str(tmp_path / 'change-token.lock')))
+    assert coordinator.mutate(lambda token: waf.update_rate_based_rule(ChangeToken=token)) == {'ChangeToken': 'token-0'}
+
+
+@patch('src.change_token_coordinator.time.sleep')
+def test_retry_on_stale_token(sleep):
+    waf = FakeWaf()
+    errors = [client_error('WAFStaleDataException'), client_error('WAFStaleDataException')]
+
+    def operation(token):
+        if errors:
+            raise errors.pop()
+        return waf.update_rate_based_rule(ChangeToken=token)
+
+    coordinator = ChangeTokenCoordinator(waf, backend=LocalLockBackend())
+    assert coordinator.mutate(operation) == {'ChangeToken': 'token-0'}
+    assert sleep.call_count == 2
+
+
+@patch('src.change_token_coordinator.time.sleep')
+def test_give_up_after_max_attempts(sleep):
+    def operation(token):
+        raise client_error('WAFStaleDataException')
+
+    coordinator = ChangeTokenCoordinator(FakeWaf(), backend=LocalLockBackend(), max_attempts=3)
+    with pytest.raises(ClientError):
+        coordinator.mutate(operation)
+    assert sleep.call_count == 2
+
+
+def test_other_errors_are_not_retried():
+    calls = []
+
+    def operation(token):
+        calls.append(token)
+        raise client_error('WAFNonexistentItemException')
+
+    coordinator = ChangeTokenCoordinator(FakeWaf(), backend=LocalLockBackend())
+    with pytest.raises(ClientError):
+        coordinator.mutate(operation)
+    assert len(calls) == 1
+
+
+class FakeDynamoDB(object):
+    def __init__(self):
+        self.items = {}
+
+    def put_item(self, TableName, Item, ConditionExpression, ExpressionAttributeValues):
+        current = self.items.get(Item['LockId']['S'])
+        if current is not None and int(current['Expires']['N']) >= int(ExpressionAttributeValues[':now']['N']):
+            raise client_error('ConditionalCheckFailedException', 'PutItem')
+        self.items[Item['LockId']['S']] = Item
+
+    def delete_item(self, TableName, Key, ConditionExpression, ExpressionAttributeValues):
+        current = self.items.get(Key['LockId']['S'])
+        if current is None or current['Owner'] != ExpressionAttributeValues[':owner']:
+            raise client_error('ConditionalCheckFailedException', 'DeleteItem')
+        del self.items[Key['LockId']['S']]
+
+
+def test_dynamodb_lease():
+    dynamodb = FakeDynamoDB()
+    backend = DynamoDBLockBackend('locks', timeout=0, dynamodb=dynamodb)
+
+    with backend.lease():
+        assert 'waf-change-token' in dynamodb.items
+        with pytest.raises(LeaseTimeout):
+            with backend.lease():
+                pass
+    assert dynamodb.items == {}
+
+
+def test_dynamodb_expired_lease_is_taken_over():
+    dynamodb = FakeDynamoDB()
+    backend = DynamoDBLockBackend('locks', lease_seconds=-10, timeout=0, dynamodb=dynamodb)
+    backend.acquire('crashed-owner')
+
+    with backend.lease():
+        assert dynamodb.items['waf-change-token']['Owner']['S'] != 'crashed-owner'
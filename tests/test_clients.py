@@ -0,0 +1,27 @@
+from mock import Mock
+
+from src.clients import ClientPool, LazyClient
+
+
+def test_client_is_created_on_first_use():
+    factory = Mock(return_value=Mock(**{'get_change_token.return_value': {'ChangeToken': 'token'}}))
+    client = LazyClient(factory)
+    factory.assert_not_called()
+
+    assert client.get_change_token()['ChangeToken'] == 'token'
+    assert client.get_change_token()['ChangeToken'] == 'token'
+    factory.assert_called_once_with()
+
+
+def test_pool_shares_clients_by_service_and_region():
+    factory = Mock(side_effect=lambda service, region: Mock(service=service, region=region))
+    pool = ClientPool(factory)
+
+    assert pool.get('waf') is pool.get('waf')
+    assert pool.get('waf-regional', 'eu-west-1') is pool.get('waf-regional', 'eu-west-1')
+    assert pool.get('waf-regional', 'eu-west-1') is not pool.get('waf-regional', 'us-east-1')
+    factory.assert_not_called()
+
+    assert pool.get('waf-regional', 'eu-west-1').region == 'eu-west-1'
+    assert pool.get('waf-regional', 'eu-west-1').get().service == 'waf-regional'
+    factory.assert_called_once_with('waf-regional', 'eu-west-1')
@@ -0,0 +1,41 @@
+import time
+
+import boto3
+import pytest
+from botocore.exceptions import ClientError
+
+from src import engine
+from tests.waf_simulator import WafSimulator
+
+
+def create_rules(client, count):
+    rule_ids = []
+    for i in range(count):
+        change_token = client.get_change_token()['ChangeToken']
+        rule = client.create_rate_based_rule(Name=f'rule{i}', MetricName=f'rule{i}', RateKey='IP', RateLimit=2000,
+                                             ChangeToken=change_token)
+        rule_ids.append(rule['Rule']['RuleId'])
+    return rule_ids
+
+
+def test_get_rules_overlaps_calls():
+    with WafSimulator().patch() as simulator:
+        client = boto3.client('waf', region_name='us-east-1')
+        rule_ids = create_rules(client, 5)
+        simulator.call_latency = 0.2
+
+        started = time.time()
+        rules = engine.run(engine.get_rules(engine.AsyncClient(client), rule_ids + ['does-not-exist']))
+        elapsed = time.time() - started
+
+        assert sorted(rules) == sorted(rule_ids), 'the rule which does not exist is left out'
+        assert elapsed < 6 * 0.2 / 2, 'the calls overlap'
+
+
+def test_errors_are_raised():
+    with WafSimulator().patch():
+        client = boto3.client('waf', region_name='us-east-1')
+        async_client = engine.AsyncClient(client)
+        with pytest.raises(ClientError) as info:
+            engine.run(async_client.delete_rate_based_rule(RuleId='does-not-exist', ChangeToken='stale'))
+        assert info.value.response['Error']['Code'] == 'WAFStaleDataException'
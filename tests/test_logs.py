@@ -0,0 +1,45 @@
+import io
+import json
+import logging
+
+from src import logs
+
+
+class Expensive(object):
+    formatted = 0
+
+    def __str__(self):
+        Expensive.formatted += 1
+        return 'expensive'
+
+
+def logger(level):
+    stream = io.StringIO()
+    log = logging.getLogger('test_logs')
+    log.propagate = False
+    log.handlers = [logging.StreamHandler(stream)]
+    logs.configure(log, level)
+    return log, stream
+
+
+def test_structured_record_with_correlation_id():
+    log, stream = logger('INFO')
+    logs.correlation.id = 'request-1'
+    log.info('Sent %d updates.', 3, extra={'rule_id': 'rule-1'})
+
+    record = json.loads(stream.getvalue())
+    assert record == {'level': 'INFO', 'message': 'Sent 3 updates.', 'correlation_id': 'request-1',
+                      'rule_id': 'rule-1'}
+
+
+def test_debug_detail_is_not_formatted_above_debug_level():
+    log, stream = logger('INFO')
+    Expensive.formatted = 0
+    log.debug('detail %s', Expensive(), extra={'detail': Expensive()})
+    assert stream.getvalue() == ''
+    assert Expensive.formatted == 0
+
+    log.setLevel('DEBUG')
+    log.debug('detail %s', Expensive(), extra={'detail': Expensive()})
+    assert json.loads(stream.getvalue())['detail'] == 'expensive'
+    assert Expensive.formatted == 2
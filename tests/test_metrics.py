@@ -0,0 +1,64 @@
+import json
+
+from botocore.exceptions import ClientError
+from mock import Mock
+import pytest
+
+from src.metrics import InstrumentedClient, Metrics
+from src.rate_based_rule_provider import handler
+from tests.test_rate_based_rule_provider import Request
+
+
+def emitted_records(output):
+    return [json.loads(line) for line in output.splitlines() if line.startswith('{"_aws"')]
+
+
+def test_one_record_per_invocation(waf, capsys):
+    predicates = [{'Negated': 'False', 'Type': 'IPMatch', 'DataId': 'data-id-1'}]
+    response = handler(Request('Create', 'test-metrics', '2345', 'IP', predicates), ())
+    assert response['Status'] == 'SUCCESS'
+
+    records = emitted_records(capsys.readouterr().out)
+    assert len(records) == 1
+    record = records[0]
+
+    metric_names = [m['Name'] for m in record['_aws']['CloudWatchMetrics'][0]['Metrics']]
+    assert set(metric_names) == {'Duration', 'ApiCalls', 'ApiErrors', 'Throttles', 'Retries', 'StatusPolls',
+                                 'SleepTime', 'TimeToInSync'}
+    assert record['Operation'] == 'Create'
+    assert record['RuleId'] == response['PhysicalResourceId']
+    assert record['ApiCallsByOperation']['get_change_token'] == 2
+    assert record['ApiCallsByOperation']['create_rate_based_rule'] == 1
+    assert record['ApiCallsByOperation']['update_rate_based_rule'] == 1
+    assert record['StatusPolls'] == record['ApiCallsByOperation']['get_change_token_status']
+    assert record['ApiCalls'] == sum(record['ApiCallsByOperation'].values())
+    assert record['SleepTime'] == pytest.approx(waf.clock.slept, abs=0.001)
+    assert record['TimeToInSync'] >= 10
+
+
+def test_retries_and_errors_are_counted(waf, capsys):
+    waf.fail_next('CreateRateBasedRule', 'WAFStaleDataException')
+    handler(Request('Create', 'test-metrics-retries', '2345'), ())
+
+    record = emitted_records(capsys.readouterr().out)[0]
+    assert record['Retries'] == 1
+    assert record['ApiErrors'] == 1
+    assert record['ApiErrorsByCode'] == {'WAFStaleDataException': 1}
+
+
+def test_instrumented_client():
+    metrics = Metrics()
+    client = Mock()
+    client.get_change_token.return_value = {'ChangeToken': 'token'}
+    client.get_change_token_status.side_effect = ClientError(
+        {'Error': {'Code': 'ThrottlingException', 'Message': 'slow down'}}, 'GetChangeTokenStatus')
+
+    instrumented = InstrumentedClient(client, metrics)
+    assert instrumented.get_change_token() == {'ChangeToken': 'token'}
+    with pytest.raises(ClientError):
+        instrumented.get_change_token_status(ChangeToken='token')
+
+    record = metrics.record('Update')
+    assert record['ApiCalls'] == 2
+    assert record['Throttles'] == 1
+    assert record['StatusPolls'] == 1
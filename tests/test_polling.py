@@ -0,0 +1,41 @@
+from src.polling import PollingStrategy, PropagationHistory
+
+
+def test_first_probe_is_short_without_history():
+    strategy = PollingStrategy(first_probe=2, cap=30, history=PropagationHistory())
+    assert strategy.delay(0) == 2
+
+
+def test_first_probe_starts_near_observed_median():
+    history = PropagationHistory()
+    for seconds in [4, 12, 9]:
+        history.record(seconds)
+
+    strategy = PollingStrategy(first_probe=2, cap=30, history=history)
+    assert strategy.delay(0) == 9
+
+    for seconds in [100, 120, 140]:
+        history.record(seconds)
+    assert strategy.delay(0) == 30, 'first probe should not exceed the cap'
+
+
+def test_exponential_growth_with_full_jitter():
+    strategy = PollingStrategy(first_probe=2, factor=2, cap=30, history=None, rand=lambda: 1.0)
+    assert [strategy.delay(attempt) for attempt in range(1, 6)] == [4, 8, 16, 30, 30]
+
+    strategy.rand = lambda: 0.5
+    assert [strategy.delay(attempt) for attempt in range(1, 6)] == [2, 4, 8, 15, 15]
+
+
+def test_deadline():
+    strategy = PollingStrategy(deadline=60)
+    assert not strategy.expired(started=100, now=159)
+    assert strategy.expired(started=100, now=160)
+
+
+def test_record():
+    history = PropagationHistory(size=2)
+    strategy = PollingStrategy(history=history)
+    for seconds in [1, 50, 60]:
+        strategy.record(seconds)
+    assert history.median() == 55
@@ -0,0 +1,52 @@
+from src.predicates import chunk_updates, diff_predicates
+
+
+def predicate(data_id, type='IPMatch', negated=False):
+    return {'Negated': negated, 'Type': type, 'DataId': data_id}
+
+
+def test_unchanged_predicates():
+    old = [predicate('data-id-1'), predicate('data-id-2')]
+    assert diff_predicates(old, list(reversed(old))) == ([], [])
+
+
+def test_insert_and_delete():
+    deletes, inserts = diff_predicates([predicate('data-id-1'), predicate('data-id-2')],
+                                       [predicate('data-id-2'), predicate('data-id-3')])
+    assert deletes == [predicate('data-id-1')]
+    assert inserts == [predicate('data-id-3')]
+
+
+def test_changed_predicate_is_replaced():
+    deletes, inserts = diff_predicates([predicate('data-id-1')], [predicate('data-id-1', 'ByteMatch', True)])
+    assert deletes == [predicate('data-id-1')]
+    assert inserts == [predicate('data-id-1', 'ByteMatch', True)]
+
+
+def test_unchanged_predicate_after_first_is_not_replaced():
+    old = [predicate('data-id-1'), predicate('data-id-2')]
+    new = [predicate('data-id-2'), predicate('data-id-3', 'XssMatch')]
+    deletes, inserts = diff_predicates(old, new)
+    assert deletes == [predicate('data-id-1')]
+    assert inserts == [predicate('data-id-3', 'XssMatch')]
+
+
+def test_large_diff_is_minimal():
+    old = [predicate(f'data-id-{i}') for i in range(3000)]
+    new = [predicate(f'data-id-{i}') for i in range(1000, 4000)]
+    deletes, inserts = diff_predicates(old, new)
+    assert deletes == old[:1000]
+    assert inserts == new[2000:]
+
+
+def test_chunk_updates_deletes_first():
+    updates = [{'Action': 'INSERT', 'Predicate': predicate(f'insert-{i}')} for i in range(3)] + \
+              [{'Action': 'DELETE', 'Predicate': predicate(f'delete-{i}')} for i in range(4)]
+
+    chunks = chunk_updates(updates, 3)
+    assert [len(chunk) for chunk in chunks] == [3, 3, 1]
+    assert [u['Action'] for chunk in chunks for u in chunk] == ['DELETE'] * 4 + ['INSERT'] * 3
+
+
+def test_chunk_no_updates():
+    assert chunk_updates([], 10) == [[]]
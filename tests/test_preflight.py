@@ -0,0 +1,23 @@
+import boto3
+
+from src.preflight import PredicateChecker
+from tests.waf_simulator import VirtualClock, WafSimulator
+
+
+def predicate(predicate_type, data_id):
+    return {'Negated': False, 'Type': predicate_type, 'DataId': data_id}
+
+
+def test_check_each_type_once():
+    with WafSimulator(clock=VirtualClock()).patch() as simulator:
+        simulator.missing_data_ids.add('geo-2')
+        checker = PredicateChecker(boto3.client('waf', region_name='us-east-1'), max_workers=4)
+        predicates = [predicate('IPMatch', 'ip-1'), predicate('GeoMatch', 'geo-2'), predicate('XssMatch', 'xss-1'),
+                      predicate('IPMatch', 'ip-1'), predicate('RegexMatch', 'regex-1')]
+
+        assert checker.missing(predicates) == [predicate('GeoMatch', 'geo-2')]
+        assert sorted(simulator.calls) == ['GetGeoMatchSet', 'GetIPSet', 'GetRegexMatchSet', 'GetXssMatchSet']
+
+        simulator.calls.clear()
+        assert checker.missing(predicates) == [predicate('GeoMatch', 'geo-2')]
+        assert simulator.calls == ['GetGeoMatchSet'], 'existing data sets are remembered'
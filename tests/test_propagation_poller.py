@@ -0,0 +1,90 @@
+import threading
+
+import boto3
+import pytest
+from botocore.exceptions import ClientError, EndpointConnectionError
+from mock import patch
+
+from src.polling import PollingStrategy
+from src.propagation_poller import PropagationPoller, PropagationTimeout
+from tests.waf_simulator import VirtualClock, WafSimulator
+
+
+def send_change(client, simulator, name, propagation_delay):
+    simulator.propagation_delay = propagation_delay
+    change_token = client.get_change_token()['ChangeToken']
+    client.create_rate_based_rule(Name=name, MetricName=name, RateKey='IP', RateLimit=2000, ChangeToken=change_token)
+    return change_token
+
+
+def test_watch_many_tokens():
+    with WafSimulator(clock=VirtualClock()).patch() as simulator:
+        client = boto3.client('waf', region_name='us-east-1')
+        poller = PropagationPoller(client)
+        strategy = PollingStrategy(history=None, rand=lambda: 1.0)
+        futures = [poller.watch(send_change(client, simulator, f'rule{i}', delay), strategy)
+                   for i, delay in enumerate([5, 20, 60])]
+
+        results = [future.result(timeout=10) for future in futures]
+        assert results[0] < results[1] < results[2]
+        assert results[2] >= 60
+        assert not poller.watched
+
+
+def test_watch_deadline():
+    with WafSimulator(clock=VirtualClock()).patch() as simulator:
+        client = boto3.client('waf', region_name='us-east-1')
+        poller = PropagationPoller(client)
+        future = poller.watch(send_change(client, simulator, 'rule', 600), PollingStrategy(history=None, deadline=100))
+
+        with pytest.raises(PropagationTimeout):
+            future.result(timeout=10)
+
+
+def test_watch_unknown_token():
+    with WafSimulator(clock=VirtualClock()).patch():
+        poller = PropagationPoller(boto3.client('waf', region_name='us-east-1'))
+        with pytest.raises(ClientError):
+            poller.watch('does-not-exist', PollingStrategy(history=None)).result(timeout=10)
+
+
+class UnreachableClient(object):
+    """
+    a WAF client which cannot connect for the first `failures` calls, and reports every token INSYNC after that.
+    """
+
+    def __init__(self, failures):
+        self.failures = failures
+
+    def get_change_token_status(self, ChangeToken):
+        if self.failures:
+            self.failures -= 1
+            raise EndpointConnectionError(endpoint_url='https://waf.amazonaws.com/')
+        return {'ChangeTokenStatus': 'INSYNC'}
+
+
+def test_watch_connection_error():
+    poller = PropagationPoller(UnreachableClient(failures=1))
+    with pytest.raises(EndpointConnectionError):
+        poller.watch('token-1', PollingStrategy(history=None)).result(timeout=10)
+
+    assert poller.watch('token-2', PollingStrategy(history=None)).result(timeout=10) >= 0
+    assert not poller.watched
+
+
+def test_watch_restarts_dead_thread():
+    poller = PropagationPoller(UnreachableClient(failures=0))
+    poller.thread = threading.Thread(target=lambda: None)
+    poller.thread.start()
+    poller.thread.join()
+
+    assert poller.wait('token', PollingStrategy(history=None)) >= 0
+
+
+def test_wait_gives_up_after_the_deadline():
+    poller = PropagationPoller(UnreachableClient(failures=0), grace=0.1)
+    poller.thread = threading.Thread(target=lambda: None)
+    poller.thread.start()
+    with patch.object(poller.thread, 'is_alive', return_value=True):
+        with pytest.raises(PropagationTimeout):
+            poller.wait('token', PollingStrategy(history=None, deadline=0))
@@ -1,62 +1,33 @@
+from botocore.config import Config
+from botocore.exceptions import ClientError
 from mock import patch
+from src.provider import handler as provider_handler
 from src.rate_based_rule_provider import handler
 from src.rate_based_rule_provider import RateBasedRuleProvider
+from src.rate_based_rule_provider import scopes
+from src.rate_based_rule_provider import waf_config
 
+import copy
+import sys
+import json
 import uuid
 
-count = 0
-
-
-def mock_boto_calls(self, operation_name, kwargs):
-    if operation_name == 'CreateRateBasedRule':
-        return {
-            'Rule': {
-                'RuleId': 'unique-id-123',
-                'Name': 'unique-name-123',
-                'MetricName': 'unique-name-123-metric',
-                'MatchPredicates': [
-                    {
-                        'Negated': False,
-                        'Type': 'ByteMatch',
-                        'DataId': 'unique-data-id-123'
-                    },
-                ],
-                'RateKey': 'IP',
-                'RateLimit': 2345
-            },
-            'ChangeToken': 'fake-change-token-1'
-        }
-    if operation_name == 'UpdateRateBasedRule':
-        return {
-            'ChangeToken': 'fake-change-token-2'
-        }
-    if operation_name == 'DeleteRateBasedRule':
-        return {
-            'ChangeToken': 'fake-change-token-3'
-        }
-    if operation_name == 'GetChangeToken':
-        return {
-            'ChangeToken': 'fake-change-token-1'
-        }
-    if operation_name == 'GetChangeTokenStatus':
-        global count
+import pytest
 
-        if count < 1:
-            count += 1
 
-            return {
-                'ChangeTokenStatus': 'PENDING'
-            }
-        else:
-            return {
-                'ChangeTokenStatus': 'INSYNC'
-            }
-    else:
-        raise ValueError(f"Unknown operation name: '{operation_name}''")
+def create_rule(name, predicates=None):
+    request = Request('Create', name, '2345', 'IP', predicates)
+    response = handler(request, ())
+    print(f"create response: {response}")
+    assert response['Status'] == 'SUCCESS'
+    return response['PhysicalResourceId']
+
 
+def live_predicates(waf, rule_id):
+    return sorted((p['DataId'], p['Type'], p['Negated']) for p in waf.rules[rule_id]['MatchPredicates'])
 
-@patch('botocore.client.BaseClient._make_api_call', mock_boto_calls)
-def test_create_based_rate_rule():
+
+def test_create_based_rate_rule(waf):
     request = Request('Create', 'test-create-rate-based-rule', '2345')
     print(f"request: {request}")
 
@@ -64,10 +35,10 @@ def test_create_based_rate_rule():
     print(f"create response: {response}")
 
     assert response['Status'] == 'SUCCESS'
+    assert waf.rules[response['PhysicalResourceId']]['RateLimit'] == 2345
 
 
-@patch('botocore.client.BaseClient._make_api_call', mock_boto_calls)
-def test_create_rate_based_rule_predicate():
+def test_create_rate_based_rule_predicate(waf):
     old_properties = {
         'Name': 'test-create-rate-based-rule-predicate',
         'MetricName': 'test-create-rate-based-rule-predicate-metric',
@@ -89,15 +60,38 @@ def test_create_rate_based_rule_predicate():
     print(f"create with predicate response: {response}")
 
     assert response['Status'] == 'SUCCESS'
+    assert live_predicates(waf, response['PhysicalResourceId']) == [('data-id-1', 'IPMatch', False)]
 
 
-@patch('botocore.client.BaseClient._make_api_call', mock_boto_calls)
-def test_update_rule_with_new_predicate():
-    # create a rule
-    request = Request('Create', 'create-rule-for-update-test', '2345')
+def test_create_rate_based_rule_predicate_waits_once(waf):
+    updates = [{'Negated': 'False', 'Type': 'IPMatch', 'DataId': 'data-id-1'}]
+    request = Request('Create', 'test-create-rate-based-rule-predicate-waits-once', '2345', 'IP', updates)
     response = handler(request, ())
-    print(f"create response: {response}")
+
+    assert response['Status'] == 'SUCCESS'
+    assert response['Reason'] == 'Create and update are done.'
+    assert waf.calls[0] == 'GetIPSet', 'checked before the create'
+    assert 'ListRateBasedRules' not in waf.calls, 'a first attempt has no rule to adopt'
+    assert waf.calls[1:5] == ['GetChangeToken', 'CreateRateBasedRule', 'GetChangeToken', 'UpdateRateBasedRule']
+    assert set(waf.calls[5:]) == {'GetChangeTokenStatus'}
+    assert all(waf.get_change_token_status(token)['ChangeTokenStatus'] == 'INSYNC' for token in waf.token_ready)
+
+
+def test_create_rate_based_rule_many_predicates_in_chunks(waf):
+    updates = [{'Negated': 'False', 'Type': 'IPMatch', 'DataId': f'data-id-{i}'} for i in range(25)]
+    request = Request('Create', 'test-create-rate-based-rule-many-predicates', '2345', 'IP', updates)
+    response = handler(request, ())
+
     assert response['Status'] == 'SUCCESS'
+    assert len(waf.rules[response['PhysicalResourceId']]['MatchPredicates']) == 25
+    assert waf.api_calls['UpdateRateBasedRule'] == 3
+    first_poll = waf.calls.index('GetChangeTokenStatus')
+    assert 'UpdateRateBasedRule' not in waf.calls[first_poll:]
+
+
+def test_update_rule_with_new_predicate(waf):
+    # create a rule
+    rule_id = create_rule('create-rule-for-update-test')
 
     # update the rule
     old_properties = {
@@ -114,22 +108,26 @@ def test_update_rule_with_new_predicate():
         }
     ]
 
-    request = Request('Update', 'test-update-with-new-predicate', '2345', 'IP', updates, old_properties)
+    request = Request('Update', 'create-rule-for-update-test', '2345', 'IP', updates, old_properties, rule_id)
     print(f"request: {request}")
 
     response = handler(request, ())
     print(f"update response: {response}")
 
     assert response['Status'] == 'SUCCESS'
+    assert live_predicates(waf, rule_id) == [('data-id-1', 'IPMatch', False)]
 
 
-@patch('botocore.client.BaseClient._make_api_call', mock_boto_calls)
-def test_update_rule_with_existing_predicate():
+def test_update_rule_with_existing_predicate(waf):
     # create a rule
-    request = Request('Create', 'create-rule-for-update-test', '2345')
-    response = handler(request, ())
-    print(f"create response: {response}")
-    assert response['Status'] == 'SUCCESS'
+    old_predicates = [
+        {
+            'Negated': 'False',
+            'Type': 'IPMatch',
+            'DataId': 'data-id-1'
+        }
+    ]
+    rule_id = create_rule('create-rule-for-update-test', old_predicates)
 
     # update the rule
     old_properties = {
@@ -137,13 +135,7 @@ def test_update_rule_with_existing_predicate():
         'MetricName': 'create-rule-for-update-test-metric',
         'RateKey': 'IP',
         'RateLimit': '2345',
-        'MatchPredicates': [
-            {
-                'Negated': 'False',
-                'Type': 'IPMatch',
-                'DataId': 'data-id-1'
-            }
-        ]
+        'MatchPredicates': old_predicates
     }
     updates = [
         {
@@ -153,21 +145,30 @@ def test_update_rule_with_existing_predicate():
         }
     ]
 
-    request = Request('Update', 'test-update-with-existing-predicate', '2345', 'IP', updates, old_properties)
+    request = Request('Update', 'create-rule-for-update-test', '2345', 'IP', updates, old_properties, rule_id)
     print(f"request: {request}")
     response = handler(request, ())
     print(f"update response: {response}")
 
     assert response['Status'] == 'SUCCESS'
+    assert live_predicates(waf, rule_id) == [('data-id-1', 'ByteMatch', True)]
 
 
-@patch('botocore.client.BaseClient._make_api_call', mock_boto_calls)
-def test_update_rule_mixed_predicate():
+def test_update_rule_mixed_predicate(waf):
     # create a rule
-    request = Request('Create', 'create-rule-for-update-test', '2345')
-    response = handler(request, ())
-    print(f"create response: {response}")
-    assert response['Status'] == 'SUCCESS'
+    old_predicates = [
+        {
+            'Negated': 'False',
+            'Type': 'IPMatch',
+            'DataId': 'data-id-1'
+        },
+        {
+            'Negated': 'False',
+            'Type': 'IPMatch',
+            'DataId': 'data-id-2'
+        }
+    ]
+    rule_id = create_rule('create-rule-for-update-test', old_predicates)
 
     # update the rule
     old_properties = {
@@ -175,18 +176,7 @@ def test_update_rule_mixed_predicate():
         'MetricName': 'create-rule-for-update-test-metric',
         'RateKey': 'IP',
         'RateLimit': '2345',
-        'MatchPredicates': [
-            {
-                'Negated': 'False',
-                'Type': 'IPMatch',
-                'DataId': 'data-id-1'
-            },
-            {
-                'Negated': 'False',
-                'Type': 'IPMatch',
-                'DataId': 'data-id-2'
-            }
-        ]
+        'MatchPredicates': old_predicates
     }
     updates = [
         {
@@ -201,21 +191,25 @@ def test_update_rule_mixed_predicate():
         }
     ]
 
-    request = Request('Update', 'test-update-mixed', '2345', 'IP', updates, old_properties)
+    request = Request('Update', 'create-rule-for-update-test', '2345', 'IP', updates, old_properties, rule_id)
     print(f"request: {request}")
     response = handler(request, ())
     print(f"update response: {response}")
 
     assert response['Status'] == 'SUCCESS'
+    assert live_predicates(waf, rule_id) == [('data-id-1', 'ByteMatch', True), ('data-id-3', 'RegexMatch', False)]
 
 
-@patch('botocore.client.BaseClient._make_api_call', mock_boto_calls)
-def test_update_rule_remove_predicate():
+def test_update_rule_remove_predicate(waf):
     # create a rule
-    request = Request('Create', 'create-rule-for-update-test', '2345')
-    response = handler(request, ())
-    print(f"create response: {response}")
-    assert response['Status'] == 'SUCCESS'
+    old_predicates = [
+        {
+            'Negated': 'False',
+            'Type': 'IPMatch',
+            'DataId': 'data-id-1'
+        }
+    ]
+    rule_id = create_rule('create-rule-for-update-test', old_predicates)
 
     # update the rule
     old_properties = {
@@ -223,31 +217,22 @@ def test_update_rule_remove_predicate():
         'MetricName': 'create-rule-for-update-test-metric',
         'RateKey': 'IP',
         'RateLimit': '2345',
-        'MatchPredicates': [
-            {
-                'Negated': 'False',
-                'Type': 'IPMatch',
-                'DataId': 'data-id-1'
-            }
-        ]
+        'MatchPredicates': old_predicates
     }
     updates = []
 
-    request = Request('Update', 'test-update-remove', '2345', 'IP', updates, old_properties)
+    request = Request('Update', 'create-rule-for-update-test', '2345', 'IP', updates, old_properties, rule_id)
     print(f"request: {request}")
     response = handler(request, ())
     print(f"update response: {response}")
 
     assert response['Status'] == 'SUCCESS'
+    assert live_predicates(waf, rule_id) == []
 
 
-@patch('botocore.client.BaseClient._make_api_call', mock_boto_calls)
-def test_update_rule_missing_arguments_predicate():
+def test_update_rule_missing_arguments_predicate(waf):
     # create a rule
-    request = Request('Create', 'create-rule-for-update-test', '2345')
-    response = handler(request, ())
-    print(f"create response: {response}")
-    assert response['Status'] == 'SUCCESS'
+    rule_id = create_rule('create-rule-for-update-test')
 
     # update the rule
     old_properties = {
@@ -263,18 +248,82 @@ def test_update_rule_missing_arguments_predicate():
         }
     ]
 
-    request = Request('Update', 'test-update-missing-arguments-predicate', '2345', 'IP', updates, old_properties)
+    request = Request('Update', 'test-update-missing-arguments-predicate', '2345', 'IP', updates, old_properties,
+                      rule_id)
     print(f"request: {request}")
     response = handler(request, ())
     print(f"update response: {response}")
 
     assert response['Status'] == 'FAILED'
-    assert response['Reason'] == "Predicate {'Type': 'ByteMatch', 'DataId': 'data-id-1'} " \
-                                 "is missing required fields: {'Negated'}"
+    assert response['Reason'] == "invalid resource properties: 'Negated' is a required property"
+
+
+def test_create_missing_arguments_predicate(waf):
+    request = Request('Create', 'test-create-missing-arguments-predicate', '2345', 'IP',
+                      [{'Type': 'IPMatch', 'DataId': 'data-id-1'}])
+    response = handler(request, ())
+
+    assert response['Status'] == 'FAILED'
+    assert response['Reason'] == "invalid resource properties: 'Negated' is a required property"
+    assert waf.calls == [], 'the request is rejected before any change is made'
+
+
+def test_update_name_replaces_rule(waf):
+    rule_id = create_rule('test-update-name-replaces-rule')
+    old_properties = Request('Create', 'test-update-name-replaces-rule', '2345')['ResourceProperties']
+    request = Request('Update', 'test-update-name-replaces-rule-renamed', '2345', old_properties=old_properties,
+                      physical_resource_id=rule_id)
+    response = handler(request, ())
 
+    assert response['Status'] == 'SUCCESS', response['Reason']
+    assert response['PhysicalResourceId'] != rule_id, 'a rule with another name replaces the old one'
+    rule = waf.rules[response['PhysicalResourceId']]
+    assert rule['Name'] == 'test-update-name-replaces-rule-renamed'
+    assert rule['MetricName'] == 'test-update-name-replaces-rule-renamed-metric'
+    assert waf.rules[rule_id]['Name'] == 'test-update-name-replaces-rule', 'CloudFormation deletes the old rule'
 
-@patch('botocore.client.BaseClient._make_api_call', mock_boto_calls)
-def test_delete_rate_based_rule_predicate():
+
+def test_update_rule_without_changes(waf):
+    old_properties = {
+        'Name': 'test-update-without-changes',
+        'MetricName': 'test-update-without-changes-metric',
+        'RateKey': 'IP',
+        'RateLimit': '2345',
+        'MatchPredicates': [
+            {'Negated': 'False', 'Type': 'IPMatch', 'DataId': 'data-id-1'},
+            {'Negated': 'True', 'Type': 'ByteMatch', 'DataId': 'data-id-2'}
+        ]
+    }
+    updates = list(reversed(old_properties['MatchPredicates']))
+    request = Request('Update', 'test-update-without-changes', '2345', 'IP', updates, old_properties,
+                      physical_resource_id='unique-id-123')
+    response = handler(request, ())
+
+    assert response['Status'] == 'SUCCESS'
+    assert response['Reason'] == 'Nothing to update.'
+    assert waf.calls == []
+
+
+def test_update_rule_already_up_to_date(waf):
+    predicates = [{'Negated': 'False', 'Type': 'ByteMatch', 'DataId': 'data-id-1'}]
+    rule_id = create_rule('test-update-already-up-to-date', predicates)
+    waf.calls.clear()
+
+    old_properties = {
+        'Name': 'test-update-already-up-to-date',
+        'MetricName': 'test-update-already-up-to-date-metric',
+        'RateKey': 'IP',
+        'RateLimit': '2000'
+    }
+    request = Request('Update', 'test-update-already-up-to-date', '2345', 'IP', predicates, old_properties, rule_id)
+    response = handler(request, ())
+
+    assert response['Status'] == 'SUCCESS'
+    assert response['Reason'] == 'The rule is already up to date.'
+    assert waf.calls == ['GetRateBasedRule']
+
+
+def test_delete_rate_based_rule_predicate(waf):
     old_properties = {
         'Name': 'create-rule-for-update-test',
         'MetricName': 'create-rule-for-update-test-metric',
@@ -288,14 +337,266 @@ def test_delete_rate_based_rule_predicate():
             }
         ]
     }
+    rule_id = create_rule('test-delete-rate-based-rule', old_properties['MatchPredicates'])
 
-    request = Request('Delete', 'test-delete-rate-based-rule', '2345', 'IP', old_properties=old_properties)
+    request = Request('Delete', 'test-delete-rate-based-rule', '2345', 'IP', old_properties=old_properties,
+                      physical_resource_id=rule_id)
     print(f"request: {request}")
 
     response = handler(request, ())
     print(f"delete response: {response}")
 
     assert response['Status'] == 'SUCCESS'
+    assert waf.rules == {}
+
+
+class Context(object):
+    invoked_function_arn = 'arn:aws:lambda:eu-west-1:123456789012:function:binxio-cfn-waf-provider'
+
+
+def test_create_asynchronous_wait(waf):
+    waf.propagation_delay = 1
+    with patch('src.rate_based_rule_provider.CONTINUATION_QUEUE_URL', 'https://sqs/continuations'):
+        request = Request('Create', 'test-create-asynchronous-wait', '2345')
+        provider = RateBasedRuleProvider()
+        slept = waf.clock.slept
+        provider.handle(request, Context())
+
+        assert provider.asynchronous
+        assert waf.clock.slept == slept, 'the invocation returns right away'
+        assert len(waf.messages) == 1
+        assert waf.messages[0]['DelaySeconds'] >= 1
+        continuation = json.loads(waf.messages[0]['body'])
+        rule_id = continuation['PhysicalResourceId']
+        assert rule_id in waf.rules
+        assert continuation['WafContinuation']['Phase'] == 'Created'
+        assert continuation['WafContinuation']['ChangeToken'] in waf.token_ready
+        assert continuation['WafContinuation']['Attempt'] == 1
+
+        waf.clock.advance(waf.messages[0]['DelaySeconds'])
+        provider_handler({'Records': [{'body': waf.messages[0]['body']}]}, Context())
+        # the provider module imports the rule provider as a top-level module
+        response = sys.modules['rate_based_rule_provider'].provider.response
+        assert response['Status'] == 'SUCCESS', response['Reason']
+        assert response['PhysicalResourceId'] == rule_id
+        assert len(waf.messages) == 1
+        assert waf.api_calls['CreateRateBasedRule'] == 1
+        assert waf.api_calls['GetChangeTokenStatus'] == 2
+
+
+def test_delete_nonexistent_rule(waf):
+    request = Request('Delete', 'test-delete-nonexistent-rule', '2345', physical_resource_id='failed-to-create')
+    response = handler(request, ())
+
+    assert response['Status'] == 'SUCCESS'
+    assert waf.calls == ['GetRateBasedRule']
+
+
+def test_delete_rule_waits_once(waf):
+    rule_id = create_rule('test-delete-rule-waits-once', [{'Negated': 'False', 'Type': 'ByteMatch', 'DataId': 'data-id-1'}])
+    waf.calls.clear()
+
+    request = Request('Delete', 'test-delete-rule-waits-once', '2345', physical_resource_id=rule_id)
+    response = handler(request, ())
+
+    assert response['Status'] == 'SUCCESS'
+    assert waf.rules == {}
+    assert waf.calls[:5] == ['GetRateBasedRule', 'GetChangeToken', 'UpdateRateBasedRule', 'GetChangeToken',
+                             'DeleteRateBasedRule']
+    assert set(waf.calls[5:]) == {'GetChangeTokenStatus'}
+
+
+def test_retry_on_stale_change_token(waf):
+    waf.fail_next('CreateRateBasedRule', 'WAFStaleDataException')
+    request = Request('Create', 'test-retry-on-stale-change-token', '2345')
+    response = handler(request, ())
+
+    assert response['Status'] == 'SUCCESS'
+    assert waf.api_calls['CreateRateBasedRule'] == 2
+    assert len(waf.rules) == 1
+
+
+def test_create_fails_on_missing_data_set_before_any_change(waf):
+    waf.missing_data_ids.add('data-id-2')
+    updates = [{'Negated': 'False', 'Type': 'IPMatch', 'DataId': f'data-id-{i}'} for i in range(4)]
+    response = handler(Request('Create', 'test-create-fails-on-missing-data-set', '2345', 'IP', updates), ())
+
+    assert response['Status'] == 'FAILED'
+    assert response['Reason'] == 'Predicate data set(s) not found: IPMatch data-id-2'
+    assert set(waf.calls) <= {'GetIPSet', 'ListRateBasedRules'}
+    assert waf.rules == {}
+
+
+def test_update_fails_on_missing_data_set_before_any_change(waf):
+    rule_id = create_rule('test-update-fails-on-missing-data-set', [
+        {'Negated': 'False', 'Type': 'IPMatch', 'DataId': 'data-id-1'}])
+    waf.missing_data_ids.add('data-id-2')
+    waf.calls.clear()
+
+    updates = [{'Negated': 'False', 'Type': 'ByteMatch', 'DataId': 'data-id-2'}]
+    request = Request('Update', 'test-update-fails-on-missing-data-set', '2345', 'IP', updates,
+                      physical_resource_id=rule_id, old_properties={
+                          'Name': 'test-update-fails-on-missing-data-set', 'RateKey': 'IP', 'RateLimit': '2345',
+                          'MetricName': 'test-update-fails-on-missing-data-set-metric'})
+    response = handler(request, ())
+
+    assert response['Status'] == 'FAILED'
+    assert 'ByteMatch data-id-2' in response['Reason']
+    assert sorted(waf.calls) == ['GetByteMatchSet', 'GetRateBasedRule'], 'data-id-1 was checked before'
+    assert live_predicates(waf, rule_id) == [('data-id-1', 'IPMatch', False)]
+
+
+def test_regional_scope(waf):
+    request = Request('Create', 'test-regional-scope', '2345')
+    request['ResourceProperties'].update({'Scope': 'Regional', 'Region': 'eu-central-1'})
+    response = handler(request, ())
+    assert response['Status'] == 'SUCCESS', response['Reason']
+    assert set(waf.endpoints) == {('waf-regional', 'eu-central-1')}
+    assert scopes.get('Regional', 'eu-central-1') is not scopes.get('Global')
+    rule_id = response['PhysicalResourceId']
+
+    waf.endpoints.clear()
+    old_properties = request['ResourceProperties']
+    # the simulator shares one backend between regions, a new name keeps it from adopting the same rule
+    request = Request('Update', 'test-regional-scope-us-west-2', '2345', old_properties=old_properties,
+                      physical_resource_id=rule_id)
+    request['ResourceProperties'].update({'Scope': 'Regional', 'Region': 'us-west-2'})
+    response = handler(request, ())
+    assert response['Status'] == 'SUCCESS', response['Reason']
+    assert response['PhysicalResourceId'] != rule_id, 'a rule in another region replaces the old one'
+    assert set(waf.endpoints) == {('waf-regional', 'us-west-2')}
+
+
+def test_create_adopts_rule_of_interrupted_attempt(waf):
+    updates = [{'Negated': 'False', 'Type': 'IPMatch', 'DataId': 'data-id-1'}]
+    request = Request('Create', 'test-create-adopts-rule-of-interrupted-attempt', '2345', 'IP', updates)
+    send_create = RateBasedRuleProvider.send_create
+
+    def time_out_after_create(provider, properties):
+        send_create(provider, properties)
+        raise Timeout()
+
+    with patch('src.rate_based_rule_provider.RateBasedRuleProvider.send_create', time_out_after_create):
+        with pytest.raises(Timeout):
+            handler(copy.deepcopy(request), ())
+    rule_id = waf.rule('test-create-adopts-rule-of-interrupted-attempt')['RuleId']
+
+    waf.calls.clear()
+    response = handler(copy.deepcopy(request), ())
+    assert response['Status'] == 'SUCCESS', response['Reason']
+    assert response['PhysicalResourceId'] == rule_id
+    assert len(waf.rules) == 1
+    assert live_predicates(waf, rule_id) == [('data-id-1', 'IPMatch', False)]
+    assert 'CreateRateBasedRule' not in waf.calls
+
+
+def test_create_does_not_adopt_rule_of_others(waf):
+    rule_id = create_rule('test-create-does-not-adopt')
+    response = handler(Request('Create', 'test-create-does-not-adopt', '2345'), ())
+
+    assert response['Status'] == 'SUCCESS', response['Reason']
+    assert response['PhysicalResourceId'] != rule_id
+    assert len(waf.rules) == 2
+
+
+def test_create_does_not_adopt_rule_with_other_rate_key(waf):
+    rule_id = create_rule('test-create-does-not-adopt-rate-key')
+    request = Request('Create', 'test-create-does-not-adopt-rate-key', '2345', 'OTHER')
+    # an earlier attempt of the request started to create the rule
+    waf.checkpoints.save(provider_checkpoint_key(request), {'Phase': 'Creating', 'ChangeToken': None,
+                                                            'PreviousChangeTokens': [], 'Attempt': 0, 'Started': 0,
+                                                            'Data': {}, 'PhysicalResourceId': None})
+    response = handler(request, ())
+
+    assert response['Status'] == 'SUCCESS', response['Reason']
+    assert response['PhysicalResourceId'] != rule_id
+    assert len(waf.rules) == 2
+
+
+def test_waf_config_without_tcp_keepalive():
+    assert waf_config().tcp_keepalive is True
+
+    # the botocore of older Lambda runtimes does not have the option
+    option_defaults = {k: v for k, v in Config.OPTION_DEFAULTS.items() if k != 'tcp_keepalive'}
+    with patch.object(Config, 'OPTION_DEFAULTS', option_defaults):
+        config = waf_config()
+    assert config.max_pool_connections == 20
+    assert config.retries == {'total_max_attempts': 1}
+
+
+class Timeout(BaseException):
+    """
+    simulates the Lambda timing out, which ends the invocation without any error handling.
+    """
+
+
+def test_resume_wait_after_timeout(waf):
+    request = Request('Create', 'test-resume-wait-after-timeout', '2345')
+    with patch('src.rate_based_rule_provider.RateBasedRuleProvider.wait_on_status', side_effect=Timeout):
+        with pytest.raises(Timeout):
+            handler(copy.deepcopy(request), ())
+    assert len(waf.rules) == 1
+
+    waf.calls.clear()
+    response = handler(copy.deepcopy(request), ())
+    assert response['Status'] == 'SUCCESS'
+    assert response['PhysicalResourceId'] in waf.rules
+    assert len(waf.rules) == 1
+    assert set(waf.calls) == {'GetChangeTokenStatus'}, 'only the outstanding change token is polled'
+    assert waf.checkpoints.load(provider_checkpoint_key(request)) is None
+
+
+def test_resume_inserts_after_timeout(waf):
+    updates = [{'Negated': 'False', 'Type': 'IPMatch', 'DataId': f'data-id-{i}'} for i in range(15)]
+    request = Request('Create', 'test-resume-inserts-after-timeout', '2345', 'IP', updates)
+    coordinator = scopes.get('Global').coordinator
+    mutate, mutations = coordinator.mutate, []
+
+    def time_out_on_third_mutation(operation):
+        mutations.append(operation)
+        if len(mutations) == 3:
+            raise Timeout()
+        return mutate(operation)
+
+    with patch('src.rate_based_rule_provider.MAX_UPDATES_PER_REQUEST', 10), \
+            patch.object(coordinator, 'mutate', time_out_on_third_mutation):
+        with pytest.raises(Timeout):
+            handler(copy.deepcopy(request), ())
+    rule_id = next(iter(waf.rules))
+    assert len(live_predicates(waf, rule_id)) == 10
+
+    response = handler(copy.deepcopy(request), ())
+    assert response['Status'] == 'SUCCESS'
+    assert response['PhysicalResourceId'] == rule_id
+    assert len(waf.rules) == 1
+    assert len(live_predicates(waf, rule_id)) == 15
+    assert waf.api_calls['CreateRateBasedRule'] == 1
+
+
+def test_checkpoint_cannot_be_loaded(waf):
+    request = Request('Create', 'test-checkpoint-cannot-be-loaded', '2345')
+    error = ClientError({'Error': {'Code': 'AccessDeniedException', 'Message': 'denied'}}, 'GetItem')
+    with patch.object(waf.checkpoints, 'load', side_effect=error):
+        response = handler(request, ())
+
+    assert response['Status'] == 'FAILED'
+    assert response['Reason'].startswith('Could not load the checkpoint:')
+    assert response['PhysicalResourceId'] == 'failed-to-create'
+    assert waf.calls == []
+
+
+def test_checkpoint_cannot_be_deleted(waf):
+    request = Request('Create', 'test-checkpoint-cannot-be-deleted', '2345')
+    error = ClientError({'Error': {'Code': 'ProvisionedThroughputExceededException', 'Message': 'slow down'}},
+                        'DeleteItem')
+    with patch.object(waf.checkpoints, 'delete', side_effect=error):
+        response = handler(request, ())
+
+    assert response['Status'] == 'SUCCESS', response['Reason']
+
+
+def provider_checkpoint_key(request):
+    return f"{request['StackId']}/{request['LogicalResourceId']}/{request['RequestId']}"
 
 
 def test_convert_properties1():
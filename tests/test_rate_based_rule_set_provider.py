@@ -0,0 +1,164 @@
+import copy
+import uuid
+
+import pytest
+from mock import patch
+
+from src.checkpoints import LocalFileCheckpointStore
+from src.rate_based_rule_set_provider import handler
+# the rule set provider imports the rule provider as a top-level module
+from rate_based_rule_provider import scopes
+
+
+def rule(name, rate_limit='2000', predicates=None):
+    properties = {'Name': name, 'MetricName': f'{name}metric', 'RateKey': 'IP', 'RateLimit': rate_limit}
+    if predicates is not None:
+        properties['MatchPredicates'] = predicates
+    return properties
+
+
+def predicate(data_id, negated='False'):
+    return {'Negated': negated, 'Type': 'IPMatch', 'DataId': data_id}
+
+
+def test_create_update_delete(waf):
+    rules = [rule('rule1'), rule('rule2', predicates=[predicate('ip-1')]), rule('rule3')]
+    response = handler(Request('Create', rules), ())
+    assert response['Status'] == 'SUCCESS', response['Reason']
+    assert len(waf.rules) == 3
+    assert response['Data']['rule2'] == waf.rule('rule2')['RuleId']
+    first_poll = waf.calls.index('GetChangeTokenStatus')
+    assert set(waf.calls[first_poll:]) == {'GetChangeTokenStatus'}, 'one wait, verifying all changes'
+    assert all(waf.get_change_token_status(token)['ChangeTokenStatus'] == 'INSYNC' for token in waf.token_ready)
+    physical_resource_id = response['PhysicalResourceId']
+
+    waf.calls.clear()
+    rule1_id = waf.rule('rule1')['RuleId']
+    new_rules = [rule('rule1'), rule('rule2', '3000', [predicate('ip-2')]), rule('rule4')]
+    response = handler(Request('Update', new_rules, rules, physical_resource_id), ())
+    assert response['Status'] == 'SUCCESS', response['Reason']
+    assert sorted(r['Name'] for r in waf.rules.values()) == ['rule1', 'rule2', 'rule4']
+    assert waf.rule('rule2')['RateLimit'] == 3000
+    assert waf.rule('rule2')['MatchPredicates'] == [{'Negated': False, 'Type': 'IPMatch', 'DataId': 'ip-2'}]
+    assert waf.rule('rule1')['RuleId'] == rule1_id
+    assert response['Data']['rule1'] == rule1_id
+    assert response['Data']['rule4'] == waf.rule('rule4')['RuleId']
+
+    response = handler(Request('Delete', new_rules, physical_resource_id=physical_resource_id), ())
+    assert response['Status'] == 'SUCCESS', response['Reason']
+    assert waf.rules == {}
+
+
+def test_duplicate_rule_names(waf):
+    response = handler(Request('Create', [rule('rule1'), rule('rule1')]), ())
+    assert response['Status'] == 'FAILED'
+    assert response['Reason'] == 'Rule names must be unique within a rule set'
+    assert waf.calls == []
+
+
+def test_resume_create_after_timeout(waf):
+    rules = [rule('rule1'), rule('rule2', predicates=[predicate('ip-1')]), rule('rule3')]
+    request = Request('Create', rules)
+    coordinator = scopes.get('Global').coordinator
+    mutate, mutations = coordinator.mutate, []
+
+    def time_out_on_third_mutation(operation):
+        mutations.append(operation)
+        if len(mutations) == 3:
+            raise Timeout()
+        return mutate(operation)
+
+    with patch.object(coordinator, 'mutate', time_out_on_third_mutation):
+        with pytest.raises(Timeout):
+            handler(copy.deepcopy(request), ())
+    assert sorted(r['Name'] for r in waf.rules.values()) == ['rule1', 'rule2']
+
+    response = handler(copy.deepcopy(request), ())
+    assert response['Status'] == 'SUCCESS', response['Reason']
+    assert sorted(r['Name'] for r in waf.rules.values()) == ['rule1', 'rule2', 'rule3']
+    assert waf.rule('rule2')['MatchPredicates'] == [{'Negated': False, 'Type': 'IPMatch', 'DataId': 'ip-1'}]
+    assert response['Data'] == {name: waf.rule(name)['RuleId'] for name in ['rule1', 'rule2', 'rule3']}
+
+
+def test_create_fails_when_a_name_is_taken(waf):
+    response = handler(Request('Create', [rule('shared')]), ())
+    assert response['Status'] == 'SUCCESS', response['Reason']
+    shared_id = waf.rule('shared')['RuleId']
+
+    waf.calls.clear()
+    response = handler(Request('Create', [rule('mine'), rule('shared')]), ())
+    assert response['Status'] == 'FAILED'
+    assert response['Reason'] == 'Rate-based rule name(s) already in use: shared'
+    assert 'CreateRateBasedRule' not in waf.calls
+    assert [r['RuleId'] for r in waf.rules.values()] == [shared_id]
+
+
+def test_delete_leaves_rules_of_others_alone(waf):
+    response = handler(Request('Create', [rule('mine')]), ())
+    assert response['Status'] == 'SUCCESS', response['Reason']
+    physical_resource_id = response['PhysicalResourceId']
+
+    # another stack creates a rule with the name which this set takes on its next update
+    response = handler(Request('Create', [rule('shared')], logical_resource_id='OtherRuleSet'), ())
+    assert response['Status'] == 'SUCCESS', response['Reason']
+    shared_id = waf.rule('shared')['RuleId']
+
+    response = handler(Request('Update', [rule('mine'), rule('shared')], [rule('mine')], physical_resource_id), ())
+    assert response['Status'] == 'FAILED'
+    assert response['Reason'] == 'Rate-based rule name(s) already in use: shared'
+
+    response = handler(Request('Delete', [rule('mine'), rule('shared')], physical_resource_id=physical_resource_id),
+                       ())
+    assert response['Status'] == 'SUCCESS', response['Reason']
+    assert [r['RuleId'] for r in waf.rules.values()] == [shared_id]
+
+
+def test_delete_fails_without_a_record_of_the_rules(waf, tmp_path):
+    response = handler(Request('Create', [rule('rule1'), rule('rule2')]), ())
+    assert response['Status'] == 'SUCCESS', response['Reason']
+    physical_resource_id = response['PhysicalResourceId']
+
+    # the records were kept in the /tmp of a container which has been recycled
+    with patch('rate_based_rule_provider.checkpoints', LocalFileCheckpointStore(str(tmp_path / 'recycled'))):
+        response = handler(Request('Delete', [rule('rule1'), rule('rule2')],
+                                   physical_resource_id=physical_resource_id), ())
+    assert response['Status'] == 'FAILED'
+    assert response['Reason'] == f'No record of the rules created by rule set {physical_resource_id}, ' \
+                                 'the rules have not been deleted'
+    assert sorted(r['Name'] for r in waf.rules.values()) == ['rule1', 'rule2']
+
+
+def test_delete_after_failed_create(waf):
+    create_rule_outside_the_set = handler(Request('Create', [rule('shared')], logical_resource_id='Other'), ())
+    assert create_rule_outside_the_set['Status'] == 'SUCCESS'
+
+    response = handler(Request('Create', [rule('shared')]), ())
+    assert response['Status'] == 'FAILED'
+
+    response = handler(Request('Delete', [rule('shared')], physical_resource_id=response['PhysicalResourceId']), ())
+    assert response['Status'] == 'SUCCESS', response['Reason']
+    assert len(waf.rules) == 1
+
+
+class Timeout(BaseException):
+    pass
+
+
+class Request(dict):
+
+    def __init__(self, request_type, rules, old_rules=None, physical_resource_id=None,
+                 logical_resource_id='RateBasedRuleSet'):
+        self.update({
+            'RequestType': request_type,
+            'ResponseURL': 'https://httpbin.org/put',
+            'StackId': 'arn:aws:cloudformation:us-west-2:EXAMPLE/stack-name/guid',
+            'RequestId': 'request-%s' % uuid.uuid4(),
+            'ResourceType': 'Custom::RateBasedRuleSet',
+            'LogicalResourceId': logical_resource_id,
+            'ResourceProperties': {'Rules': rules}})
+
+        if old_rules is not None:
+            self['OldResourceProperties'] = {'Rules': old_rules}
+
+        if physical_resource_id is not None:
+            self['PhysicalResourceId'] = physical_resource_id
@@ -0,0 +1,39 @@
+import boto3
+
+from src.rule_index import RuleIndex
+from tests.waf_simulator import VirtualClock, WafSimulator
+
+
+def add_rules(simulator, count):
+    for i in range(count):
+        simulator.rules[f'id-{i}'] = {'RuleId': f'id-{i}', 'Name': f'rule-{i % (count - 1)}', 'MetricName': f'm{i}',
+                                      'MatchPredicates': [], 'RateKey': 'IP', 'RateLimit': 2000}
+
+
+def test_index_all_pages():
+    with WafSimulator(clock=VirtualClock()).patch() as simulator:
+        add_rules(simulator, 250)
+        index = RuleIndex(boto3.client('waf', region_name='us-east-1'))
+
+        assert index.ids('rule-0') == ['id-0', 'id-249']
+        assert index.ids('rule-248') == ['id-248']
+        assert index.ids('rule-does-not-exist') == []
+        assert simulator.api_calls['ListRateBasedRules'] == 3
+
+
+def test_index_is_cached_until_expired_or_invalidated():
+    with WafSimulator(clock=VirtualClock()).patch() as simulator:
+        add_rules(simulator, 10)
+        index = RuleIndex(boto3.client('waf', region_name='us-east-1'), ttl=60)
+        index.ids('rule-1')
+        simulator.clock.advance(59)
+        index.ids('rule-2')
+        assert simulator.api_calls['ListRateBasedRules'] == 1
+
+        simulator.clock.advance(1)
+        index.ids('rule-1')
+        assert simulator.api_calls['ListRateBasedRules'] == 2
+
+        index.invalidate()
+        index.ids('rule-1')
+        assert simulator.api_calls['ListRateBasedRules'] == 3
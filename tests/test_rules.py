@@ -0,0 +1,35 @@
+from src.rules import RULE_SCHEMA, Predicate, Rule, compile_schema
+
+
+def test_coerce_only_typed_properties():
+    properties = {'Name': '123', 'MetricName': 'true', 'RateKey': 'IP', 'RateLimit': '2000',
+                  'MatchPredicates': [{'Negated': 'False', 'Type': 'IPMatch', 'DataId': '42'}]}
+    schema = compile_schema(RULE_SCHEMA)
+    schema.coerce(properties)
+    schema.coerce(properties)
+
+    assert properties == {'Name': '123', 'MetricName': 'true', 'RateKey': 'IP', 'RateLimit': 2000,
+                          'MatchPredicates': [{'Negated': False, 'Type': 'IPMatch', 'DataId': '42'}]}
+    assert schema.error(properties) is None
+
+
+def test_invalid_properties():
+    schema = compile_schema(RULE_SCHEMA)
+    properties = schema.coerce({'Name': 'n', 'MetricName': 'm', 'RateKey': 'IP', 'RateLimit': 'many'})
+    assert schema.error(properties) == "'many' is not of type 'integer'"
+
+    properties = {'Name': 'n', 'MetricName': 'm', 'RateKey': 'IP', 'RateLimit': 2000,
+                  'MatchPredicates': [{'Negated': False, 'Type': 'IPMismatch', 'DataId': 'd'}]}
+    assert 'IPMismatch' in schema.error(properties)
+
+
+def test_schema_is_compiled_once():
+    assert compile_schema(RULE_SCHEMA) is compile_schema(dict(RULE_SCHEMA))
+
+
+def test_rule_state_ignores_predicate_order():
+    a = Rule.from_dict({'RateLimit': 2000, 'MatchPredicates': [
+        {'Negated': False, 'Type': 'IPMatch', 'DataId': 'a'}, {'Negated': True, 'Type': 'GeoMatch', 'DataId': 'b'}]})
+    b = Rule('name', 'metric', 'IP', 2000, [Predicate(True, 'GeoMatch', 'b'), Predicate(False, 'IPMatch', 'a')])
+    assert a.state == b.state
+    assert a.state != Rule('name', 'metric', 'IP', 2001, b.predicates).state
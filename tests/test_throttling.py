@@ -0,0 +1,53 @@
+import boto3
+import pytest
+from botocore.exceptions import ClientError
+
+from src.metrics import InstrumentedClient
+from src.throttling import RetryingClient, TokenBucket
+from tests.waf_simulator import VirtualClock, WafSimulator
+
+
+def test_token_bucket_limits_rate():
+    with WafSimulator(clock=VirtualClock()).patch() as simulator:
+        bucket = TokenBucket(rate=2, capacity=2)
+        started = simulator.clock.time()
+        for _ in range(6):
+            bucket.acquire()
+        assert simulator.clock.time() - started == pytest.approx(2.0)
+
+
+def test_retry_on_throttling():
+    with WafSimulator(clock=VirtualClock(), max_calls_per_second=3).patch() as simulator:
+        client = RetryingClient(boto3.client('waf', region_name='us-east-1'), bucket=TokenBucket(rate=100))
+        for _ in range(10):
+            client.get_change_token()
+
+        assert simulator.throttled > 0
+        assert simulator.api_calls['GetChangeToken'] == 10 + simulator.throttled
+
+
+def test_token_bucket_prevents_throttling():
+    with WafSimulator(clock=VirtualClock(), max_calls_per_second=3).patch() as simulator:
+        client = RetryingClient(boto3.client('waf', region_name='us-east-1'), bucket=TokenBucket(rate=3, capacity=1))
+        for _ in range(10):
+            client.get_change_token()
+
+        assert simulator.throttled == 0
+
+
+def test_fatal_errors_are_not_retried():
+    with WafSimulator(clock=VirtualClock()).patch() as simulator:
+        client = RetryingClient(boto3.client('waf', region_name='us-east-1'), bucket=TokenBucket(rate=100))
+        with pytest.raises(ClientError):
+            client.get_rate_based_rule(RuleId='does-not-exist')
+        assert simulator.api_calls['GetRateBasedRule'] == 1
+
+
+def test_give_up_after_max_attempts():
+    with WafSimulator(clock=VirtualClock()).patch() as simulator:
+        simulator.fail_next('GetChangeToken', 'ThrottlingException', count=3)
+        client = RetryingClient(InstrumentedClient(boto3.client('waf', region_name='us-east-1')),
+                                bucket=TokenBucket(rate=100), max_attempts=3)
+        with pytest.raises(ClientError):
+            client.get_change_token()
+        assert simulator.api_calls['GetChangeToken'] == 3
@@ -0,0 +1,52 @@
+import json
+
+from src.rate_based_rule_provider import handler
+from src.verifier import handler as verify
+from tests.test_metrics import emitted_records
+from tests.test_rate_based_rule_provider import Context, Request
+
+
+def acknowledged_request(name):
+    request = Request('Create', name, '2345', 'IP', [{'Negated': 'False', 'Type': 'IPMatch', 'DataId': 'data-id-1'}])
+    request['ResourceProperties']['PropagationMode'] = 'Acknowledge'
+    return request
+
+
+def test_acknowledge_and_verify(waf, capsys):
+    response = handler(acknowledged_request('test-acknowledge-and-verify'), Context())
+    assert response['Status'] == 'SUCCESS', response['Reason']
+    assert response['Reason'] == 'Create and update are done.'
+    assert 'GetChangeTokenStatus' not in waf.calls, 'no wait for the change to propagate'
+    assert len(waf.invocations) == 1
+
+    verification = json.loads(waf.invocations[0])
+    assert sorted(verification['WafVerification']['ChangeTokens']) == sorted(waf.token_ready)
+    assert verification['PhysicalResourceId'] == response['PhysicalResourceId']
+    capsys.readouterr()
+
+    result = verify(verification, Context())
+    assert result['Status'] == 'INSYNC'
+    record = emitted_records(capsys.readouterr().out)[0]
+    assert record['Operation'] == 'Verify'
+    assert record['PropagationFailures'] == 0
+    assert record['TimeToInSync'] >= 10
+
+
+def test_verifier_reports_propagation_failure(waf, capsys):
+    waf.propagation_delay = 3600
+    response = handler(acknowledged_request('test-verifier-reports-propagation-failure'), Context())
+    assert response['Status'] == 'SUCCESS', response['Reason']
+    capsys.readouterr()
+
+    result = verify(json.loads(waf.invocations[0]), Context())
+    assert result['Status'] == 'FAILED'
+    record = emitted_records(capsys.readouterr().out)[0]
+    assert record['PropagationFailures'] == 1
+    assert 'PropagationFailures' in [m['Name'] for m in record['_aws']['CloudWatchMetrics'][0]['Metrics']]
+
+
+def test_acknowledge_outside_lambda_waits(waf):
+    response = handler(acknowledged_request('test-acknowledge-outside-lambda-waits'), ())
+    assert response['Status'] == 'SUCCESS', response['Reason']
+    assert 'GetChangeTokenStatus' in waf.calls
+    assert waf.invocations == []
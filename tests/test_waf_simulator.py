@@ -0,0 +1,73 @@
+import boto3
+import pytest
+from botocore.exceptions import ClientError, ParamValidationError
+
+from tests.waf_simulator import VirtualClock, WafSimulator
+
+
+def error_code(info):
+    return info.value.response['Error']['Code']
+
+
+def test_change_token_semantics():
+    clock = VirtualClock()
+    with WafSimulator(propagation_delay=30, clock=clock).patch():
+        waf = boto3.client('waf', region_name='us-east-1')
+        token = waf.get_change_token()['ChangeToken']
+        assert waf.get_change_token()['ChangeToken'] == token, 'the token is the same until it is used'
+        assert waf.get_change_token_status(ChangeToken=token)['ChangeTokenStatus'] == 'PROVISIONED'
+
+        rule = waf.create_rate_based_rule(Name='r', MetricName='r', RateKey='IP', RateLimit=2000, ChangeToken=token)
+        assert waf.get_change_token_status(ChangeToken=token)['ChangeTokenStatus'] == 'PENDING'
+
+        with pytest.raises(ClientError) as info:
+            waf.delete_rate_based_rule(RuleId=rule['Rule']['RuleId'], ChangeToken=token)
+        assert error_code(info) == 'WAFStaleDataException'
+
+        clock.sleep(30)
+        assert waf.get_change_token_status(ChangeToken=token)['ChangeTokenStatus'] == 'INSYNC'
+        assert waf.get_change_token()['ChangeToken'] != token
+
+
+def test_nonexistent_and_non_empty_items(waf):
+    client = boto3.client('waf', region_name='us-east-1')
+    with pytest.raises(ClientError) as info:
+        client.get_rate_based_rule(RuleId='does-not-exist')
+    assert error_code(info) == 'WAFNonexistentItemException'
+
+    rule_id = client.create_rate_based_rule(Name='r', MetricName='r', RateKey='IP', RateLimit=2000,
+                                            ChangeToken=client.get_change_token()['ChangeToken'])['Rule']['RuleId']
+    predicate = {'Negated': False, 'Type': 'IPMatch', 'DataId': 'ip-1'}
+    client.update_rate_based_rule(RuleId=rule_id, RateLimit=2000, ChangeToken=client.get_change_token()['ChangeToken'],
+                                  Updates=[{'Action': 'INSERT', 'Predicate': predicate}])
+
+    with pytest.raises(ClientError) as info:
+        client.delete_rate_based_rule(RuleId=rule_id, ChangeToken=client.get_change_token()['ChangeToken'])
+    assert error_code(info) == 'WAFNonEmptyEntityException'
+
+
+def test_throttling():
+    with WafSimulator(clock=VirtualClock(), max_calls_per_second=2).patch() as simulator:
+        client = boto3.client('waf', region_name='us-east-1')
+        client.get_change_token()
+        client.get_change_token()
+        with pytest.raises(ClientError) as info:
+            client.get_change_token()
+        assert error_code(info) == 'ThrottlingException'
+
+        simulator.clock.sleep(1)
+        client.get_change_token()
+        assert simulator.throttled == 1
+
+
+def test_malformed_requests_are_rejected(waf):
+    client = boto3.client('waf', region_name='us-east-1')
+    rule_id = client.create_rate_based_rule(Name='r', MetricName='r', RateKey='IP', RateLimit=2000,
+                                            ChangeToken=client.get_change_token()['ChangeToken'])['Rule']['RuleId']
+    waf.calls.clear()
+    with pytest.raises(ParamValidationError):
+        client.update_rate_based_rule(RuleId=rule_id, RateLimit=2000,
+                                      ChangeToken=client.get_change_token()['ChangeToken'],
+                                      Updates=[{'Action': 'INSERT', 'Predicate': {'Type': 'IPMatch', 'DataId': 'ip-1'}}])
+    assert waf.calls == ['GetChangeToken'], 'the malformed request is not sent'
+    assert waf.rules[rule_id]['MatchPredicates'] == []
@@ -0,0 +1,136 @@
+import uuid
+
+import boto3
+
+from src.web_acl_rate_based_rule_attachment_provider import diff_activated_rules, handler
+
+
+def create_rules(count):
+    client = boto3.client('waf', region_name='us-east-1')
+    rule_ids = []
+    for i in range(count):
+        change_token = client.get_change_token()['ChangeToken']
+        rule = client.create_rate_based_rule(Name=f'rule{i}', MetricName=f'rule{i}', RateKey='IP', RateLimit=2000,
+                                             ChangeToken=change_token)
+        rule_ids.append(rule['Rule']['RuleId'])
+    return rule_ids
+
+
+def create_web_acl(name='acl'):
+    client = boto3.client('waf', region_name='us-east-1')
+    change_token = client.get_change_token()['ChangeToken']
+    return client.create_web_acl(Name=name, MetricName=name, DefaultAction={'Type': 'ALLOW'},
+                                 ChangeToken=change_token)['WebACL']['WebACLId']
+
+
+def attachment(rule_id, priority, action='BLOCK'):
+    return {'RuleId': rule_id, 'Priority': str(priority), 'Action': {'Type': action}}
+
+
+def activated_rules(waf, web_acl_id):
+    return sorted((r['RuleId'], r['Priority'], r['Action']['Type']) for r in waf.web_acls[web_acl_id]['Rules'])
+
+
+def test_attach_many_rules_in_one_change(waf):
+    rule_ids = create_rules(20)
+    web_acl_id = create_web_acl()
+    waf.calls.clear()
+
+    attachments = [attachment(rule_id, i) for i, rule_id in enumerate(rule_ids)]
+    response = handler(Request('Create', web_acl_id, attachments), ())
+    assert response['Status'] == 'SUCCESS', response['Reason']
+    assert response['Reason'] == 'Attach is done.'
+    assert activated_rules(waf, web_acl_id) == sorted((rule_id, i, 'BLOCK') for i, rule_id in enumerate(rule_ids))
+    assert waf.api_calls['UpdateWebACL'] == 1
+    assert waf.api_calls['GetChangeToken'] == 1
+    assert set(waf.calls[waf.calls.index('UpdateWebACL') + 1:]) == {'GetChangeTokenStatus'}
+
+
+def test_update_and_detach(waf):
+    rule_ids = create_rules(3)
+    web_acl_id = create_web_acl()
+    client = boto3.client('waf', region_name='us-east-1')
+    other = {'Priority': 100, 'RuleId': 'other-rule', 'Action': {'Type': 'COUNT'}, 'Type': 'REGULAR'}
+    waf.web_acls[web_acl_id]['Rules'].append(other)
+
+    attachments = [attachment(rule_ids[0], 1), attachment(rule_ids[1], 2)]
+    response = handler(Request('Create', web_acl_id, attachments), ())
+    assert response['Status'] == 'SUCCESS', response['Reason']
+    physical_resource_id = response['PhysicalResourceId']
+
+    waf.calls.clear()
+    new_attachments = [attachment(rule_ids[0], 1), attachment(rule_ids[1], 3, 'COUNT'), attachment(rule_ids[2], 2)]
+    response = handler(Request('Update', web_acl_id, new_attachments, attachments, physical_resource_id), ())
+    assert response['Status'] == 'SUCCESS', response['Reason']
+    assert response['PhysicalResourceId'] == physical_resource_id
+    assert activated_rules(waf, web_acl_id) == sorted([(rule_ids[0], 1, 'BLOCK'), (rule_ids[1], 3, 'COUNT'),
+                                                       (rule_ids[2], 2, 'BLOCK'), ('other-rule', 100, 'COUNT')])
+    assert waf.api_calls['UpdateWebACL'] == 1
+
+    waf.calls.clear()
+    response = handler(Request('Update', web_acl_id, new_attachments, new_attachments, physical_resource_id), ())
+    assert response['Status'] == 'SUCCESS', response['Reason']
+    assert 'UpdateWebACL' not in waf.calls, 'nothing changed'
+
+    response = handler(Request('Delete', web_acl_id, new_attachments, physical_resource_id=physical_resource_id), ())
+    assert response['Status'] == 'SUCCESS', response['Reason']
+    assert client.get_web_acl(WebACLId=web_acl_id)['WebACL']['Rules'] == [other], 'other rules are left alone'
+
+
+def test_attach_fails_on_missing_rule_before_any_change(waf):
+    rule_ids = create_rules(1)
+    web_acl_id = create_web_acl()
+    waf.calls.clear()
+
+    response = handler(Request('Create', web_acl_id, [attachment(rule_ids[0], 1), attachment('does-not-exist', 2)]),
+                       ())
+    assert response['Status'] == 'FAILED'
+    assert response['Reason'] == 'Rate-based rule(s) not found: does-not-exist'
+    assert response['PhysicalResourceId'] == 'failed-to-create'
+    assert 'UpdateWebACL' not in waf.calls
+    assert waf.web_acls[web_acl_id]['Rules'] == []
+
+
+def test_duplicate_priorities(waf):
+    response = handler(Request('Create', 'acl', [attachment('rule1', 1), attachment('rule2', 1)]), ())
+    assert response['Status'] == 'FAILED'
+    assert response['Reason'] == 'Priorities must be unique within an attachment'
+    assert waf.calls == []
+
+
+def test_delete_of_missing_web_acl(waf):
+    response = handler(Request('Delete', 'does-not-exist', [attachment('rule1', 1)], physical_resource_id='id'), ())
+    assert response['Status'] == 'SUCCESS', response['Reason']
+
+
+def test_diff_activated_rules():
+    live = [{'Priority': 1, 'RuleId': 'r1', 'Action': {'Type': 'BLOCK'}, 'Type': 'RATE_BASED'},
+            {'Priority': 2, 'RuleId': 'r2', 'Action': {'Type': 'BLOCK'}, 'Type': 'RATE_BASED'},
+            {'Priority': 3, 'RuleId': 'r3', 'Action': {'Type': 'BLOCK'}, 'Type': 'RATE_BASED'},
+            {'Priority': 4, 'RuleId': 'r4', 'Action': {'Type': 'BLOCK'}, 'Type': 'REGULAR'}]
+    attachments = [{'RuleId': 'r1', 'Priority': 1, 'Action': {'Type': 'BLOCK'}},
+                   {'RuleId': 'r2', 'Priority': 5, 'Action': {'Type': 'BLOCK'}}]
+    old_attachments = attachments + [{'RuleId': 'r3', 'Priority': 3, 'Action': {'Type': 'BLOCK'}}]
+
+    deletes, inserts = diff_activated_rules(live, attachments, old_attachments)
+    assert deletes == [live[1], live[2]]
+    assert inserts == [{'Priority': 5, 'RuleId': 'r2', 'Action': {'Type': 'BLOCK'}, 'Type': 'RATE_BASED'}]
+
+
+class Request(dict):
+
+    def __init__(self, request_type, web_acl_id, rules, old_rules=None, physical_resource_id=None):
+        self.update({
+            'RequestType': request_type,
+            'ResponseURL': 'https://httpbin.org/put',
+            'StackId': 'arn:aws:cloudformation:us-west-2:EXAMPLE/stack-name/guid',
+            'RequestId': 'request-%s' % uuid.uuid4(),
+            'ResourceType': 'Custom::WebACLRateBasedRuleAttachment',
+            'LogicalResourceId': 'WebACLRateBasedRuleAttachment',
+            'ResourceProperties': {'WebACLId': web_acl_id, 'Rules': rules}})
+
+        if old_rules is not None:
+            self['OldResourceProperties'] = {'WebACLId': web_acl_id, 'Rules': old_rules}
+
+        if physical_resource_id is not None:
+            self['PhysicalResourceId'] = physical_resource_id
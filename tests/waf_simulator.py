@@ -0,0 +1,305 @@
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from botocore import xform_name
+from botocore.exceptions import ClientError
+from botocore.validate import validate_parameters
+from mock import patch
+
+
+class VirtualClock(object):
+    """
+    a clock which only advances when someone sleeps, so that propagation delays cost no wall-clock time.
+    """
+
+    def __init__(self, now=1500000000.0):
+        self.now = now
+        self.slept = 0.0
+        self.lock = threading.Lock()
+
+    def time(self):
+        return self.now
+
+    def advance(self, seconds):
+        with self.lock:
+            self.now += seconds
+
+    def sleep(self, seconds):
+        with self.lock:
+            self.now += seconds
+            self.slept += seconds
+
+
+class WafSimulator(object):
+    """
+    an in-process WAF Classic backend with realistic change token semantics:
+
+    - get_change_token returns the same token until it is used in a mutation;
+    - a used token is stale, and so is any token other than the current one;
+    - a used token is PENDING for `propagation_delay` seconds, and INSYNC after that;
+    - operations on non-existent items and on rules which still have predicates fail;
+    - a rule cannot be deleted while it is attached to a web ACL, and a web ACL rejects duplicate rule ids and
+      priorities;
+    - every predicate data set exists, except the ids in `missing_data_ids`;
+    - more than `max_calls_per_second` calls per second are throttled;
+    - requests which botocore would reject are rejected with a ParamValidationError, before they count as a call.
+
+    The calls are counted per service and region in `endpoints`, but all services and regions share one backend.
+    Lambda invocations are recorded in `invocations`, and SQS messages in `messages`.
+
+    `patch()` routes all boto3 calls to the simulator, and replaces time.time and time.sleep by the virtual clock
+    if one is given.
+    """
+
+    def __init__(self, propagation_delay=0.0, call_latency=0.0, clock=None, max_calls_per_second=None):
+        self.propagation_delay = propagation_delay
+        self.call_latency = call_latency
+        self.clock = clock
+        self.max_calls_per_second = max_calls_per_second
+        self.lock = threading.RLock()
+        self.rules = {}
+        self.web_acls = {}
+        self.current_token = None
+        self.token_ready = {}
+        self.injected_errors = []
+        self.invocations = []
+        self.messages = []
+        self.calls = []
+        self.endpoints = Counter()
+        self.throttled = 0
+        self.call_times = []
+        self.missing_data_ids = set()
+
+    @property
+    def api_calls(self):
+        return Counter(self.calls)
+
+    @property
+    def change_tokens_consumed(self):
+        return len(self.token_ready)
+
+    def now(self):
+        return self.clock.time() if self.clock is not None else time.time()
+
+    def rule(self, name):
+        return next(r for r in self.rules.values() if r['Name'] == name)
+
+    def fail_next(self, operation_name, code, count=1):
+        """
+        fails the next `count` calls to `operation_name` with the error `code`.
+        """
+        self.injected_errors.extend([(operation_name, code)] * count)
+
+    @contextmanager
+    def patch(self):
+        with ExitStack() as stack:
+            stack.enter_context(patch('botocore.client.BaseClient._make_api_call',
+                                      lambda client, operation_name, kwargs: self.make_api_call(operation_name, kwargs,
+                                                                                                client.meta)))
+            if self.clock is not None:
+                stack.enter_context(patch('time.time', self.clock.time))
+                stack.enter_context(patch('time.sleep', self.clock.sleep))
+            yield self
+
+    def make_api_call(self, operation_name, kwargs, meta=None):
+        if meta is not None:
+            # like botocore, reject malformed requests before they are sent
+            validate_parameters(kwargs, meta.service_model.operation_model(operation_name).input_shape)
+
+        if self.call_latency:
+            if self.clock is not None:
+                self.clock.advance(self.call_latency)
+            else:
+                threading.Event().wait(self.call_latency)
+
+        with self.lock:
+            self.calls.append(operation_name)
+            if meta is not None:
+                self.endpoints[(meta.service_model.service_name, meta.region_name)] += 1
+            self.throttle(operation_name)
+            for i, (name, code) in enumerate(self.injected_errors):
+                if name == operation_name:
+                    del self.injected_errors[i]
+                    raise error(code, operation_name)
+
+            method = getattr(self, xform_name(operation_name), None)
+            if method is None:
+                raise ValueError(f"Unknown operation name: '{operation_name}'")
+            return method(**kwargs)
+
+    def throttle(self, operation_name):
+        if self.max_calls_per_second is None:
+            return
+        now = self.now()
+        self.call_times = [t for t in self.call_times if now - t < 1.0]
+        if len(self.call_times) >= self.max_calls_per_second:
+            self.throttled += 1
+            raise error('ThrottlingException', operation_name)
+        self.call_times.append(now)
+
+    def use_token(self, change_token, operation_name):
+        if change_token != self.current_token:
+            raise error('WAFStaleDataException', operation_name)
+
+    def consume_token(self, change_token):
+        self.token_ready[change_token] = self.now() + self.propagation_delay
+        self.current_token = None
+
+    def get_rule(self, rule_id, operation_name):
+        if rule_id not in self.rules:
+            raise error('WAFNonexistentItemException', operation_name)
+        return self.rules[rule_id]
+
+    def get_change_token(self):
+        if self.current_token is None:
+            self.current_token = str(uuid.uuid4())
+        return {'ChangeToken': self.current_token}
+
+    def get_change_token_status(self, ChangeToken):
+        if ChangeToken == self.current_token:
+            return {'ChangeTokenStatus': 'PROVISIONED'}
+        if ChangeToken not in self.token_ready:
+            raise error('WAFNonexistentItemException', 'GetChangeTokenStatus')
+        return {'ChangeTokenStatus': 'INSYNC' if self.now() >= self.token_ready[ChangeToken] else 'PENDING'}
+
+    def create_rate_based_rule(self, Name, MetricName, RateKey, RateLimit, ChangeToken, Tags=None):
+        self.use_token(ChangeToken, 'CreateRateBasedRule')
+        rule_id = str(uuid.uuid4())
+        self.rules[rule_id] = {'RuleId': rule_id, 'Name': Name, 'MetricName': MetricName,
+                               'MatchPredicates': [], 'RateKey': RateKey, 'RateLimit': RateLimit}
+        self.consume_token(ChangeToken)
+        return {'Rule': self.copy(self.rules[rule_id]), 'ChangeToken': ChangeToken}
+
+    def get_rate_based_rule(self, RuleId):
+        return {'Rule': self.copy(self.get_rule(RuleId, 'GetRateBasedRule'))}
+
+    def list_rate_based_rules(self, Limit=100, NextMarker=None):
+        rules = list(self.rules.values())
+        start = int(NextMarker) if NextMarker else 0
+        page = [{'RuleId': r['RuleId'], 'Name': r['Name']} for r in rules[start:start + Limit]]
+        response = {'Rules': page}
+        if start + Limit < len(rules):
+            response['NextMarker'] = str(start + Limit)
+        return response
+
+    def update_rate_based_rule(self, RuleId, ChangeToken, Updates, RateLimit):
+        self.use_token(ChangeToken, 'UpdateRateBasedRule')
+        rule = self.get_rule(RuleId, 'UpdateRateBasedRule')
+        predicates = list(rule['MatchPredicates'])
+        for update in Updates:
+            if update['Action'] == 'INSERT':
+                if update['Predicate']['DataId'] in self.missing_data_ids:
+                    raise error('WAFNonexistentItemException', 'UpdateRateBasedRule')
+                if update['Predicate'] in predicates:
+                    raise error('WAFInvalidOperationException', 'UpdateRateBasedRule')
+                predicates.append(update['Predicate'])
+            elif update['Predicate'] in predicates:
+                predicates.remove(update['Predicate'])
+            else:
+                raise error('WAFNonexistentItemException', 'UpdateRateBasedRule')
+
+        rule['MatchPredicates'] = predicates
+        rule['RateLimit'] = RateLimit
+        self.consume_token(ChangeToken)
+        return {'ChangeToken': ChangeToken}
+
+    def delete_rate_based_rule(self, RuleId, ChangeToken):
+        self.use_token(ChangeToken, 'DeleteRateBasedRule')
+        rule = self.get_rule(RuleId, 'DeleteRateBasedRule')
+        if rule['MatchPredicates']:
+            raise error('WAFNonEmptyEntityException', 'DeleteRateBasedRule')
+        if any(r['RuleId'] == RuleId for acl in self.web_acls.values() for r in acl['Rules']):
+            raise error('WAFReferencedItemException', 'DeleteRateBasedRule')
+        del self.rules[RuleId]
+        self.consume_token(ChangeToken)
+        return {'ChangeToken': ChangeToken}
+
+    def create_web_acl(self, Name, MetricName, DefaultAction, ChangeToken, Tags=None):
+        self.use_token(ChangeToken, 'CreateWebACL')
+        web_acl_id = str(uuid.uuid4())
+        self.web_acls[web_acl_id] = {'WebACLId': web_acl_id, 'Name': Name, 'MetricName': MetricName,
+                                     'DefaultAction': DefaultAction, 'Rules': []}
+        self.consume_token(ChangeToken)
+        return {'WebACL': self.copy_web_acl(self.web_acls[web_acl_id]), 'ChangeToken': ChangeToken}
+
+    def get_web_acl(self, WebACLId):
+        if WebACLId not in self.web_acls:
+            raise error('WAFNonexistentItemException', 'GetWebACL')
+        return {'WebACL': self.copy_web_acl(self.web_acls[WebACLId])}
+
+    def update_web_acl(self, WebACLId, ChangeToken, Updates=(), DefaultAction=None):
+        self.use_token(ChangeToken, 'UpdateWebACL')
+        if WebACLId not in self.web_acls:
+            raise error('WAFNonexistentItemException', 'UpdateWebACL')
+        web_acl = self.web_acls[WebACLId]
+        activated_rules = [dict(r) for r in web_acl['Rules']]
+        for update in Updates:
+            activated_rule = update['ActivatedRule']
+            if update['Action'] == 'INSERT':
+                if activated_rule.get('Type') == 'RATE_BASED' and activated_rule['RuleId'] not in self.rules:
+                    raise error('WAFNonexistentItemException', 'UpdateWebACL')
+                if any(r['RuleId'] == activated_rule['RuleId'] or r['Priority'] == activated_rule['Priority']
+                       for r in activated_rules):
+                    raise error('WAFInvalidOperationException', 'UpdateWebACL')
+                activated_rules.append(dict(activated_rule))
+            elif activated_rule in activated_rules:
+                activated_rules.remove(activated_rule)
+            else:
+                raise error('WAFNonexistentItemException', 'UpdateWebACL')
+
+        web_acl['Rules'] = activated_rules
+        if DefaultAction is not None:
+            web_acl['DefaultAction'] = DefaultAction
+        self.consume_token(ChangeToken)
+        return {'ChangeToken': ChangeToken}
+
+    def get_data_set(self, operation_name, name, id_name, data_id):
+        if data_id in self.missing_data_ids:
+            raise error('WAFNonexistentItemException', operation_name)
+        return {name: {id_name: data_id}}
+
+    def get_ip_set(self, IPSetId):
+        return self.get_data_set('GetIPSet', 'IPSet', 'IPSetId', IPSetId)
+
+    def get_byte_match_set(self, ByteMatchSetId):
+        return self.get_data_set('GetByteMatchSet', 'ByteMatchSet', 'ByteMatchSetId', ByteMatchSetId)
+
+    def get_sql_injection_match_set(self, SqlInjectionMatchSetId):
+        return self.get_data_set('GetSqlInjectionMatchSet', 'SqlInjectionMatchSet', 'SqlInjectionMatchSetId',
+                                 SqlInjectionMatchSetId)
+
+    def get_geo_match_set(self, GeoMatchSetId):
+        return self.get_data_set('GetGeoMatchSet', 'GeoMatchSet', 'GeoMatchSetId', GeoMatchSetId)
+
+    def get_size_constraint_set(self, SizeConstraintSetId):
+        return self.get_data_set('GetSizeConstraintSet', 'SizeConstraintSet', 'SizeConstraintSetId',
+                                 SizeConstraintSetId)
+
+    def get_xss_match_set(self, XssMatchSetId):
+        return self.get_data_set('GetXssMatchSet', 'XssMatchSet', 'XssMatchSetId', XssMatchSetId)
+
+    def get_regex_match_set(self, RegexMatchSetId):
+        return self.get_data_set('GetRegexMatchSet', 'RegexMatchSet', 'RegexMatchSetId', RegexMatchSetId)
+
+    def invoke(self, FunctionName, InvocationType, Payload):
+        self.invocations.append(Payload)
+        return {'StatusCode': 202}
+
+    def send_message(self, QueueUrl, MessageBody, DelaySeconds=0):
+        self.messages.append({'body': MessageBody, 'DelaySeconds': DelaySeconds})
+        return {'MessageId': str(uuid.uuid4())}
+
+    @staticmethod
+    def copy(rule):
+        return dict(rule, MatchPredicates=[dict(p) for p in rule['MatchPredicates']])
+
+    @staticmethod
+    def copy_web_acl(web_acl):
+        return dict(web_acl, Rules=[dict(r, Action=dict(r['Action'])) for r in web_acl['Rules']])
+
+
+def error(code, operation_name):
+    return ClientError({'Error': {'Code': code, 'Message': f'simulated {code}'}}, operation_name)